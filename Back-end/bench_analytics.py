@@ -0,0 +1,77 @@
+# bench_analytics.py - Daily rollup vs. raw consultation scan for analytics
+#
+# Times a year of per-day and per-doctor outcome counts computed two ways
+# against the database in DATABASE_URL (populate it with generate_data.py
+# first): straight from consultation + consultation_archive, and from the
+# consultation_daily_stat rollup behind /api/analytics/consultations:
+#   python bench_analytics.py --days 365 --runs 5
+# Also reports how long a full rollup rebuild takes and the rows each side reads.
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text, union_all
+
+from app import (app, db, Consultation, ConsultationArchive, ConsultationDailyStat,
+                 REBUILD_DAILY_STATS_SQL, consultation_analytics)
+
+
+def raw_analytics(start, end):
+    sides = [select(model.doctor_id, model.scheduled_time, model.status)
+             .where(model.scheduled_time >= start, model.scheduled_time < end)
+             for model in (Consultation, ConsultationArchive)]
+    history = union_all(*sides).subquery()
+    day = func.date(history.c.scheduled_time)
+    by_day = db.session.execute(select(day, history.c.status, func.count()).group_by(day, history.c.status)).all()
+    by_doctor = db.session.execute(
+        select(history.c.doctor_id, history.c.status, func.count()).group_by(history.c.doctor_id, history.c.status)
+    ).all()
+    return by_day, by_doctor
+
+
+def timed(fn, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(times), 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare rollup-backed analytics with a raw scan')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        today = datetime.utcnow().date()
+        end = today + timedelta(days=1)
+        start = end - timedelta(days=args.days)
+        start_time = datetime.combine(start, datetime.min.time())
+        end_time = datetime.combine(end, datetime.min.time())
+
+        started = time.perf_counter()
+        for statement in REBUILD_DAILY_STATS_SQL:
+            db.session.execute(text(statement))
+        db.session.commit()
+        print(f"🔄 Rebuilt the daily rollup in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        raw_rows = sum(db.session.scalar(select(func.count()).select_from(model).where(
+            model.scheduled_time >= start_time, model.scheduled_time < end_time))
+            for model in (Consultation, ConsultationArchive))
+        rollup_rows = db.session.scalar(select(func.count()).select_from(ConsultationDailyStat).where(
+            ConsultationDailyStat.day >= start, ConsultationDailyStat.day < end))
+        raw_ms = timed(lambda: raw_analytics(start_time, end_time), args.runs)
+        rollup_ms = timed(lambda: consultation_analytics(start, end, today), args.runs)
+        print(f"📊 {args.days} days, all doctors")
+        print(f"   raw scan: {raw_rows:>9} rows  {raw_ms:8.1f} ms")
+        print(f"   rollup:   {rollup_rows:>9} rows  {rollup_ms:8.1f} ms")
+        doctor_id = db.session.scalar(select(ConsultationDailyStat.doctor_id).limit(1))
+        if doctor_id is not None:
+            rows = db.session.scalar(select(func.count()).select_from(ConsultationDailyStat).where(
+                ConsultationDailyStat.doctor_id == doctor_id,
+                ConsultationDailyStat.day >= start, ConsultationDailyStat.day < end))
+            ms = timed(lambda: consultation_analytics(start, end, today, doctor_id), args.runs)
+            print(f"   rollup, one doctor: {rows:>5} rows  {ms:8.1f} ms")
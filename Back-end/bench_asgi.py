@@ -0,0 +1,177 @@
+# bench_asgi.py - Sync (gunicorn gthread) vs. async (uvicorn asgi.py) deployment
+#
+# Starts both deployments with the same number of worker processes against
+# the database in DATABASE_URL (populate it with generate_data.py first), then
+# drives the read routes at increasing concurrency with keep-alive clients:
+#   python bench_asgi.py --workers 2 --concurrency 8 64 256 --seconds 10 --out bench-asgi.json
+# The report includes each deployment's resident memory (master + workers),
+# so results can be compared at equal memory as well as equal worker count.
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from flask_jwt_extended import create_access_token
+
+from app import app, User
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def tree_rss_mb(pid):
+    # Resident memory of pid and its children, from /proc (Linux only)
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except OSError:
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return round(total / 1024, 1)
+
+
+def start(name, command, port):
+    proc = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/health', timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'{name} did not start')
+
+
+async def client(port, requests, deadline, results):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    i = 0
+    try:
+        while time.monotonic() < deadline:
+            path, token = requests[i % len(requests)]
+            i += 1
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer {token}\r\n\r\n'.encode())
+            start = time.perf_counter()
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            results.append((status, (time.perf_counter() - start) * 1000))
+    except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+        results.append((None, None))
+    finally:
+        writer.close()
+
+
+async def load(port, requests, concurrency, seconds):
+    results = []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*(client(port, requests, deadline, results) for _ in range(concurrency)))
+    latencies = [ms for status, ms in results if status == 200]
+    return {
+        'requests': len(results),
+        'per_second': round(len(results) / seconds, 1),
+        'errors': sum(1 for status, _ in results if status != 200),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def make_requests():
+    with app.app_context():
+        admin = User.query.filter_by(role='admin', is_active=True).first()
+        doctor = User.query.filter_by(role='doctor', is_active=True).first()
+        patient = User.query.filter_by(role='patient', is_active=True).first()
+        if not (admin and doctor and patient):
+            sys.exit('❌ Needs an admin, a doctor and a patient; run generate_data.py first')
+        token = {u.role: create_access_token(identity=str(u.id)) for u in (admin, doctor, patient)}
+    return [
+        ('/api/dashboard/admin', token['admin']),
+        ('/api/dashboard/doctor', token['doctor']),
+        ('/api/dashboard/patient', token['patient']),
+        ('/api/patients?limit=50', token['doctor']),
+        ('/api/doctors', token['patient']),
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare gunicorn gthread and uvicorn ASGI deployments')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='gthread threads per sync worker')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64, 256])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--out', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    requests = make_requests()
+    deployments = {
+        'sync': ['gunicorn', 'app:app', '--worker-class', 'gthread', '--workers', str(args.workers),
+                 '--threads', str(args.threads)],
+        'async': ['uvicorn', 'asgi:application', '--workers', str(args.workers), '--no-access-log'],
+    }
+    report = {}
+    for name, command in deployments.items():
+        port = free_port()
+        bind = ['--bind', f'127.0.0.1:{port}'] if name == 'sync' else ['--host', '127.0.0.1', '--port', str(port)]
+        print(f"🔄 Starting {name}: {' '.join(command)}")
+        proc = start(name, command + bind, port)
+        try:
+            asyncio.run(load(port, requests, 4, 2))  # warm up caches and pools
+            report[name] = {'rss_mb': tree_rss_mb(proc.pid), 'runs': {}}
+            for concurrency in args.concurrency:
+                result = asyncio.run(load(port, requests, concurrency, args.seconds))
+                report[name]['runs'][str(concurrency)] = result
+                print(f"   {concurrency:>4} clients: {result['per_second']:>8} req/s  "
+                      f"p50 {result['p50_ms'] or 0:7.1f} ms  p99 {result['p99_ms'] or 0:7.1f} ms  "
+                      f"errors {result['errors']}")
+            report[name]['rss_mb_after'] = tree_rss_mb(proc.pid)
+            print(f"   memory: {report[name]['rss_mb']} MB after warm-up, {report[name]['rss_mb_after']} MB after load")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.out}")
@@ -0,0 +1,87 @@
+# bench_booking.py - Fire simultaneous bookings at one doctor slot
+#
+#   python bench_booking.py --attempts 300
+#   python bench_booking.py --attempts 300 --url http://localhost:5000
+#
+# Every attempt books the same doctor and slot for a different patient and all
+# of them are released at once. Exactly one should get 201; the rest must get
+# 409. Needs at least --attempts patients (see generate_data.py).
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from app import app, db, User, Consultation
+
+
+def find_free_slot(doctor_id, slot_minutes):
+    slot = (datetime.utcnow() + timedelta(days=30)).replace(hour=8, minute=0, second=0, microsecond=0)
+    while Consultation.query.filter_by(doctor_id=doctor_id, scheduled_time=slot, status='scheduled').first():
+        slot += timedelta(minutes=slot_minutes)
+    return slot
+
+
+def run(args):
+    with app.app_context():
+        doctor = User.query.filter_by(role='doctor', is_active=True).first()
+        patients = User.query.filter_by(role='patient', is_active=True).limit(args.attempts).all()
+        if not doctor or len(patients) < args.attempts:
+            print(f"❌ Need 1 doctor and {args.attempts} patients; run generate_data.py first")
+            return
+        slot = find_free_slot(doctor.id, app.config['CONSULTATION_SLOT_MINUTES'])
+        body = json.dumps({'doctor_id': doctor.id, 'scheduled_time': slot.isoformat()}).encode('utf-8')
+        tokens = [create_access_token(identity=str(p.id), additional_claims={'role': p.role, 'email': p.email})
+                  for p in patients]
+        db.session.remove()
+
+    barrier = threading.Barrier(args.attempts)
+    results = []
+    lock = threading.Lock()
+
+    def attempt(token):
+        headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+        client = None if args.url else app.test_client()
+        barrier.wait()
+        start = time.perf_counter()
+        if client:
+            status = client.post('/api/consultations', data=body, headers=headers).status_code
+        else:
+            req = urllib.request.Request(f"{args.url.rstrip('/')}/api/consultations", data=body, headers=headers)
+            try:
+                with urllib.request.urlopen(req, timeout=60) as resp:
+                    status = resp.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+        with lock:
+            results.append((status, (time.perf_counter() - start) * 1000))
+
+    threads = [threading.Thread(target=attempt, args=(token,)) for token in tokens]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = sorted(ms for _, ms in results)
+    print(f"📅 {args.attempts} attempts for doctor {doctor.id} at {slot.isoformat()}")
+    print(f"   statuses: {statuses}")
+    print(f"   latency p50 {latencies[len(latencies) // 2]:.1f}ms, max {latencies[-1]:.1f}ms")
+
+    with app.app_context():
+        booked = Consultation.query.filter_by(doctor_id=doctor.id, scheduled_time=slot, status='scheduled').count()
+    ok = statuses.get(201) == 1 and booked == 1
+    print(f"{'✅' if ok else '❌'} {booked} scheduled consultation(s) stored for the slot")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Concurrent double-booking stress test')
+    parser.add_argument('--attempts', type=int, default=200)
+    parser.add_argument('--url', help='Target a running server instead of the in-process test client')
+    run(parser.parse_args())
@@ -0,0 +1,332 @@
+# bench_endpoints.py - Latency and SQL-count benchmark for every API route
+#
+# GET routes run first, against the seeded data. Write routes follow: bookings
+# go to free slots after the latest consultation and are rescheduled and
+# cancelled again, but registered and imported rows stay, so benchmark a copy
+# of the database (or pass --read-only). Routes left out are listed at the end.
+#
+# In-process (Flask test client, also counts SQL statements per request):
+#   python bench_endpoints.py --requests 50 --out bench-$(git rev-parse --short HEAD).json
+# Against a running server (latency only):
+#   python bench_endpoints.py --url http://localhost:5000 --out bench-gunicorn.json
+# Compare two result files:
+#   python bench_endpoints.py --compare bench-old.json bench-new.json
+#
+# Seed a realistic database first with generate_data.py; the benchmark signs in
+# as the busiest doctor and patient so per-user dashboards are not trivially small.
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, func
+
+from app import app, db, User, Consultation, slot_start
+
+# Endpoints never benchmarked, and why
+SKIP_ENDPOINTS = {
+    'static': 'serves files, not an API route',
+    'consultation_events': 'Server-Sent Events stream that never ends, so draining it would hang',
+    'run_archive': 'moves old consultations out of the live table for good, so later runs would read other data',
+}
+
+# Rows per import request
+IMPORT_ROWS = 100
+
+# Exports stream the whole table by default; bench them over a fixed window
+EXPORT_WINDOW = timedelta(days=7)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def pick_users():
+    def busiest(column, role):
+        row = db.session.query(column, func.count(Consultation.id)) \
+            .group_by(column).order_by(func.count(Consultation.id).desc()).first()
+        if row:
+            return db.session.get(User, row[0])
+        return User.query.filter_by(role=role).first()
+
+    return {
+        'admin': User.query.filter_by(role='admin').first(),
+        'doctor': busiest(Consultation.doctor_id, 'doctor'),
+        'patient': busiest(Consultation.patient_id, 'patient'),
+    }
+
+
+def token_for(user):
+    return create_access_token(identity=str(user.id), additional_claims={'role': user.role, 'email': user.email})
+
+
+def export_query():
+    # The week up to the latest consultation, so the export has rows to stream
+    latest = db.session.query(func.max(Consultation.scheduled_time)).scalar() or datetime.utcnow()
+    return f"?from={(latest - EXPORT_WINDOW).date().isoformat()}&to={(latest + timedelta(days=1)).date().isoformat()}"
+
+
+def slots_path(users):
+    # The doctor's latest day with consultations, so the slots are not empty
+    latest = db.session.query(func.max(Consultation.scheduled_time)) \
+        .filter(Consultation.doctor_id == users['doctor'].id,
+                Consultation.scheduled_time <= datetime.utcnow()).scalar() or datetime.utcnow()
+    return f"/api/doctors/{users['doctor'].id}/slots?date={latest.date().isoformat()}"
+
+
+# Seeded URL arguments for GET routes that take them
+GET_ARGUMENTS = {'get_doctor_slots': slots_path}
+
+
+def get_routes(users):
+    # (endpoint, name, path); results are named by rule when the path holds ids
+    routes = []
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint in SKIP_ENDPOINTS or 'GET' not in rule.methods:
+            continue
+        if rule.arguments:
+            if rule.endpoint in GET_ARGUMENTS and users.get('doctor'):
+                routes.append((rule.endpoint, rule.rule, GET_ARGUMENTS[rule.endpoint](users)))
+        elif rule.rule.startswith('/api/admin/export'):
+            routes.append((rule.endpoint, rule.rule + export_query(), rule.rule + export_query()))
+        else:
+            routes.append((rule.endpoint, rule.rule, rule.rule))
+    return sorted(routes, key=lambda route: route[1])
+
+
+def to_ndjson(rows):
+    return ''.join(json.dumps(row) + '\n' for row in rows)
+
+
+def bench_writes(bench, users, count):
+    # Each step gets the request index, so every request books its own slot
+    # or registers its own email
+    run_id = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    patient, doctor = users['patient'], users['doctor']
+    length = timedelta(minutes=app.config['CONSULTATION_SLOT_MINUTES'])
+    latest = db.session.query(func.max(Consultation.scheduled_time)).scalar() or datetime.utcnow()
+    start = slot_start(max(latest, datetime.utcnow())) + timedelta(days=1)
+    slot = lambda i: (start + i * length).isoformat()
+    rare = max(1, count // 10)
+
+    bench('create_consultation', 'POST', '/api/consultations', 'patient', '/api/consultations',
+          lambda i: {'doctor_id': doctor.id, 'scheduled_time': slot(i)}, count)
+    # Ends the outer read transaction so the bookings committed above are visible
+    db.session.rollback()
+    booked = [c.id for c in Consultation.query.filter(
+        Consultation.doctor_id == doctor.id,
+        Consultation.scheduled_time >= start,
+        Consultation.status == 'scheduled').order_by(Consultation.scheduled_time)]
+    if booked:
+        bench('update_consultation', 'PUT', '/api/consultations/<int:consultation_id>', 'patient',
+              lambda i: f'/api/consultations/{booked[i % len(booked)]}',
+              lambda i: {'scheduled_time': slot(count + i)}, count)
+        bench('cancel_consultation_route', 'POST', '/api/consultations/<int:consultation_id>/cancel', 'patient',
+              lambda i: f'/api/consultations/{booked[i % len(booked)]}/cancel', None, count)
+
+    bench('register', 'POST', '/api/register', None, '/api/register',
+          lambda i: {'email': f'bench-{run_id}-{i}@bench.test', 'password': 'password123',
+                     'first_name': 'Bench', 'last_name': f'User{i}', 'role': 'patient'}, rare)
+    # Rows carry an existing hash, so the import measures the inserts, not bcrypt
+    bench('import_users_route', 'POST', '/api/admin/import/users', 'admin', '/api/admin/import/users',
+          lambda i: to_ndjson({'email': f'bench-{run_id}-{i}-{n}@import.test', 'first_name': 'Bench',
+                               'last_name': f'Import{n}', 'password_hash': patient.password_hash}
+                              for n in range(IMPORT_ROWS)), rare)
+    # Cancelled rows hold no slot, so they never collide with the bookings
+    bench('import_consultations_route', 'POST', '/api/admin/import/consultations', 'admin',
+          '/api/admin/import/consultations',
+          lambda i: to_ndjson({'patient_id': patient.id, 'doctor_id': doctor.id, 'status': 'cancelled',
+                               'scheduled_time': slot(2 * count + i * IMPORT_ROWS + n)}
+                              for n in range(IMPORT_ROWS)), rare)
+    bench('reconcile_counters_route', 'POST', '/api/admin/counters/reconcile', 'admin',
+          '/api/admin/counters/reconcile', None, rare)
+
+
+class InProcessClient:
+    def __init__(self):
+        self.client = app.test_client()
+        self.statements = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+    def request(self, method, path, token=None, body=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        # A string body is an NDJSON import
+        payload = {'data': body, 'content_type': 'application/x-ndjson'} if isinstance(body, str) else {'json': body}
+        self.statements = 0
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, headers=headers, **payload)
+        size = len(response.get_data())  # drains streamed bodies inside the timing
+        elapsed = (time.perf_counter() - start) * 1000
+        return response.status_code, elapsed, self.statements, size
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, token=None, body=None):
+        headers = {'Content-Type': 'application/x-ndjson' if isinstance(body, str) else 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        if isinstance(body, str):
+            data = body.encode('utf-8')
+        else:
+            data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                size = len(resp.read())
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            size = len(e.read())
+            status = e.code
+        elapsed = (time.perf_counter() - start) * 1000
+        return status, elapsed, None, size
+
+
+def measure(client, method, path, token, body, count):
+    # path and body may be functions of the request index
+    latencies, statements, statuses = [], [], {}
+    size = None
+    for i in range(count):
+        status, elapsed, sql, size = client.request(method, path(i) if callable(path) else path, token,
+                                                    body(i) if callable(body) else body)
+        latencies.append(elapsed)
+        if sql is not None:
+            statements.append(sql)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': count,
+        'statuses': statuses,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': statistics.mean(latencies),
+        'sql_statements': max(statements) if statements else None,
+        'response_bytes': size,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    with app.app_context():
+        users = pick_users()
+        tokens = {role: token_for(user) for role, user in users.items() if user}
+        client = HttpClient(args.url) if args.url else InProcessClient()
+
+        results = {}
+        covered = set()
+
+        def bench(endpoint, method, name, role, path, body, count):
+            label = f'{method} {name} [{role}]' if role else f'{method} {name}'
+            results[label] = measure(client, method, path, tokens.get(role), body, count)
+            covered.add(endpoint)
+            print(f"⏱️  {label} p50={results[label]['p50_ms']:.2f}ms")
+
+        for endpoint, name, path in get_routes(users):
+            for role, token in tokens.items():
+                # One warm-up request doubles as the access check
+                status = client.request('GET', path, token)[0]
+                if status in (401, 403, 404):
+                    continue
+                bench(endpoint, 'GET', name, role, path, None, args.requests)
+                if path.startswith('/api/admin/export'):
+                    break
+
+        # A batch only runs GET sub-requests, so it belongs with the reads
+        for role, token in tokens.items():
+            paths = ['/api/me', '/api/doctors', f'/api/dashboard/{role}']
+            bench('batch', 'POST', '/api/batch', role, '/api/batch', {'requests': paths}, args.requests)
+
+        if args.password and users.get('patient'):
+            body = {'email': users['patient'].email, 'password': args.password}
+            bench('login', 'POST', '/api/login', None, '/api/login', body, max(1, args.requests // 10))
+
+        if not args.read_only and all(tokens.get(role) for role in ('admin', 'doctor', 'patient')):
+            bench_writes(bench, users, args.requests)
+
+        skipped = {}
+        for rule in app.url_map.iter_rules():
+            if rule.endpoint in covered:
+                continue
+            if rule.endpoint in SKIP_ENDPOINTS:
+                skipped[rule.endpoint] = SKIP_ENDPOINTS[rule.endpoint]
+            elif rule.endpoint == 'login' and not args.password:
+                skipped[rule.endpoint] = 'no --password given'
+            elif args.read_only and 'GET' not in rule.methods:
+                skipped[rule.endpoint] = 'write route, skipped with --read-only'
+            else:
+                skipped[rule.endpoint] = 'no seeded request for it, or no benchmarked user may call it'
+        for endpoint, reason in sorted(skipped.items()):
+            print(f"⚠️  Not benchmarked: {endpoint} ({reason})")
+
+        return {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'target': args.url or 'in-process',
+            'python': platform.python_version(),
+            'database': db.engine.url.render_as_string(hide_password=True),
+            'users': User.query.count(),
+            'consultations': Consultation.query.count(),
+            'results': results,
+            'skipped': skipped,
+        }
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'route':<55} {'p50 old':>9} {'p50 new':>9} {'p99 old':>9} {'p99 new':>9} {'sql':>9}")
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if not before:
+            continue
+        sql = f"{before['sql_statements']}->{result['sql_statements']}"
+        print(f"{name:<55} {before['p50_ms']:>9.2f} {result['p50_ms']:>9.2f} "
+              f"{before['p99_ms']:>9.2f} {result['p99_ms']:>9.2f} {sql:>9}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark every route in app.py')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process test client')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per route and role')
+    parser.add_argument('--password', default='password123',
+                        help='Password of the benchmarked patient, for /api/login (empty to skip)')
+    parser.add_argument('--read-only', action='store_true',
+                        help='Skip the write routes, for a database that must not change')
+    parser.add_argument('--out', help='Write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        report = run(args)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"✅ Results written to {args.out}")
+        else:
+            print(json.dumps(report, indent=2))
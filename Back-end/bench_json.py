@@ -0,0 +1,92 @@
+# bench_json.py - JSON serialization CPU and response bytes per encoding
+#
+# Runs the largest list endpoints in-process against the database in
+# DATABASE_URL (populate it with generate_data.py first), once with the stdlib
+# json serializer and once with orjson, for each Accept-Encoding:
+#   python bench_json.py --requests 20 --out bench-json.json
+# CPU is process time per request (serialization, compression and the
+# queries), so the encoder and compression costs show up as differences
+# between rows of the same endpoint.
+import argparse
+import json
+import statistics
+import time
+
+from flask_jwt_extended import create_access_token
+
+from app import app, brotli, orjson, User
+
+ENCODINGS = ['identity', 'gzip', 'br']
+
+
+def make_token():
+    with app.app_context():
+        admin = User.query.filter_by(role='admin', is_active=True).first()
+        if not admin:
+            raise SystemExit('❌ Needs an admin user; run generate_data.py first')
+        return create_access_token(identity=str(admin.id))
+
+
+def measure_serializer(payload, requests):
+    # Encoder alone: the /api/users body, built once, through app.json
+    cpu = []
+    with app.app_context():
+        for _ in range(requests):
+            start = time.process_time()
+            app.json.response(payload)
+            cpu.append((time.process_time() - start) * 1000)
+    return round(statistics.mean(cpu), 2)
+
+
+def measure(client, path, token, encoding, requests):
+    headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': encoding}
+    client.get(path, headers=headers)  # warm up the user cache and connection
+    cpu = []
+    for _ in range(requests):
+        start = time.process_time()
+        response = client.get(path, headers=headers)
+        response.get_data()
+        cpu.append((time.process_time() - start) * 1000)
+    return {
+        'status': response.status_code,
+        'content_encoding': response.headers.get('Content-Encoding', 'identity'),
+        'bytes': len(response.get_data()),
+        'cpu_ms_mean': round(statistics.mean(cpu), 2),
+        'cpu_ms_p50': round(statistics.median(cpu), 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare JSON serializers and response compression')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--paths', nargs='+', default=['/api/users', '/api/patients?limit=500'])
+    parser.add_argument('--out', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    token = make_token()
+    client = app.test_client()
+    serializers = ['stdlib'] + (['orjson'] if orjson is not None else [])
+    if orjson is None:
+        print('⚠️  orjson is not installed, measuring the stdlib serializer only')
+    if brotli is None:
+        print('⚠️  brotli is not installed, br requests are served with gzip or uncompressed')
+
+    with app.app_context():
+        payload = {'users': [u.to_dict() for u in User.query.all()]}
+    report = {'serialize_users': {}}
+    for serializer in serializers:
+        app.json.use_orjson = serializer == 'orjson'
+        report['serialize_users'][serializer] = measure_serializer(payload, args.requests)
+        print(f"{'serialize /api/users body':<28} {serializer:<7} {'':<9} {'':>10}        "
+              f"        cpu {report['serialize_users'][serializer]:8.2f} ms")
+        for path in args.paths:
+            for encoding in ENCODINGS:
+                result = measure(client, path, token, encoding, args.requests)
+                report.setdefault(path, {}).setdefault(serializer, {})[encoding] = result
+                print(f"{path:<28} {serializer:<7} {encoding:<9} {result['bytes']:>10} bytes "
+                      f"({result['content_encoding']})  cpu {result['cpu_ms_mean']:8.2f} ms")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.out}")
@@ -0,0 +1,109 @@
+# bench_login.py - Login throughput vs. latency of other endpoints
+#
+# Run against a live server (e.g. `gunicorn app:app`) seeded by init_db.py:
+#   python bench_login.py --url http://localhost:5000 --concurrency 16 --seconds 20
+# Compare runs with different BCRYPT_POOL_SIZE / worker settings on the server.
+# --stuffing sends wrong passwords instead, cycling through --emails-file (one
+# existing email per line) or --email, so every unthrottled attempt runs bcrypt.
+# Compare with LOGIN_IP_BURST=0 LOGIN_ACCOUNT_BURST=0 on the server to see what
+# the login buckets save.
+import argparse
+import itertools
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def timed_request(url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, (time.perf_counter() - start) * 1000
+
+
+def run(url, email, password, concurrency, seconds, probe_interval, stuffing=False):
+    deadline = time.monotonic() + seconds
+    login_results = []
+    probe_results = []
+    lock = threading.Lock()
+    emails = itertools.cycle(email if isinstance(email, list) else [email])
+
+    def login_loop():
+        while time.monotonic() < deadline:
+            body = {'email': next(emails), 'password': 'not-the-password' if stuffing else password}
+            result = timed_request(f'{url}/api/login', body)
+            with lock:
+                login_results.append(result)
+
+    def probe_loop():
+        while time.monotonic() < deadline:
+            result = timed_request(f'{url}/api/health')
+            with lock:
+                probe_results.append(result)
+            time.sleep(probe_interval)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(concurrency)]
+    threads.append(threading.Thread(target=probe_loop))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    def summary(results):
+        latencies = [ms for status, ms in results if status is not None]
+        statuses = {}
+        for status, _ in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(results),
+            'per_second': round(len(results) / seconds, 1),
+            'statuses': statuses,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': statistics.mean(latencies) if latencies else None,
+        }
+
+    return {'login': summary(login_results), 'health': summary(probe_results)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure /api/health latency under a /api/login burst')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--email', default='patient@kalafo.com')
+    parser.add_argument('--password', default='patient123')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--probe-interval', type=float, default=0.05)
+    parser.add_argument('--stuffing', action='store_true', help='Send wrong passwords')
+    parser.add_argument('--emails-file', help='Emails to cycle through, one per line')
+    args = parser.parse_args()
+
+    email = args.email
+    if args.emails_file:
+        with open(args.emails_file) as f:
+            email = [line.strip() for line in f if line.strip()]
+
+    print(f"🔄 {args.concurrency} login clients for {args.seconds}s against {args.url}...")
+    report = run(args.url.rstrip('/'), email, args.password,
+                 args.concurrency, args.seconds, args.probe_interval, args.stuffing)
+    print(json.dumps(report, indent=2))
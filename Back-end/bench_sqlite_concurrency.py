@@ -0,0 +1,68 @@
+# bench_sqlite_concurrency.py - Do SQLite reads wait on an open write transaction?
+#
+#   python bench_sqlite_concurrency.py
+#
+# For each journal mode, a writer holds a write transaction open for
+# --hold seconds while a reader repeatedly counts rows through an engine
+# configured like the app's. In DELETE (rollback journal) mode the reads stall
+# until the writer commits; in WAL mode they return immediately.
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+
+from app import app, engine_options
+
+
+def run_mode(journal_mode, hold, reads):
+    app.config['SQLITE_JOURNAL_MODE'] = journal_mode
+    path = os.path.join(tempfile.mkdtemp(), 'concurrency.db')
+    url = f'sqlite:///{path}'
+    engine = create_engine(url, **engine_options(url))
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE item (id INTEGER PRIMARY KEY, value TEXT)'))
+        conn.execute(text('INSERT INTO item (value) VALUES (:v)'), [{'v': str(i)} for i in range(1000)])
+
+    writer_ready = threading.Event()
+
+    def writer():
+        with engine.connect() as conn:
+            # A tiny page cache makes the writer spill to the database file mid-transaction,
+            # which is when a rollback journal needs its exclusive lock (as with any large write)
+            conn.exec_driver_sql('PRAGMA cache_size=10')
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            conn.execute(text('INSERT INTO item (value) VALUES (:v)'), [{'v': 'x' * 500} for _ in range(5000)])
+            writer_ready.set()
+            time.sleep(hold)
+            conn.exec_driver_sql('COMMIT')
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    writer_ready.wait()
+
+    latencies, errors = [], 0
+    for _ in range(reads):
+        start = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(text('SELECT COUNT(*) FROM item')).scalar()
+        except Exception:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    thread.join()
+    engine.dispose()
+    return max(latencies), sorted(latencies)[len(latencies) // 2], errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare SQLite read latency under an open write transaction')
+    parser.add_argument('--hold', type=float, default=2.0, help='Seconds the writer keeps its transaction open')
+    parser.add_argument('--reads', type=int, default=20)
+    args = parser.parse_args()
+
+    for mode in ('DELETE', 'WAL'):
+        worst, median, errors = run_mode(mode, args.hold, args.reads)
+        print(f"{mode:<7} reads while writing: median {median:.1f}ms, worst {worst:.1f}ms, errors {errors}")
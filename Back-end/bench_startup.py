@@ -0,0 +1,126 @@
+# bench_startup.py - Time from process start to the first served /api/health
+#
+# Starts gunicorn with and without --preload at the same worker count against
+# the database in DATABASE_URL (run `flask --app app db-upgrade` first, since
+# workers no longer touch the schema), polls /api/health until it answers and
+# reports the time along with the process tree's RSS and PSS. PSS splits
+# shared pages between the processes sharing them, so memory that preloaded
+# workers inherit from the master is counted once:
+#   python bench_startup.py --workers 4 --runs 3 --out bench-startup.json
+# Also times a bare `import app`, the floor for booting any worker.
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def tree_pids(pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except OSError:
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        stack.extend(children.get(current, []))
+    return pids
+
+
+def tree_memory_mb(pid):
+    # RSS and PSS of pid and its children, from /proc (Linux only)
+    totals = {'Rss:': 0, 'Pss:': 0}
+    for current in tree_pids(pid):
+        try:
+            with open(f'/proc/{current}/smaps_rollup') as f:
+                for line in f:
+                    field = line.split()
+                    if field and field[0] in totals:
+                        totals[field[0]] += int(field[1])
+        except OSError:
+            pass
+    return round(totals['Rss:'] / 1024, 1), round(totals['Pss:'] / 1024, 1)
+
+
+def time_import(runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, check=True)
+        times.append(time.perf_counter() - started)
+    return round(statistics.median(times), 3)
+
+
+def time_to_health(command, port, timeout=60):
+    started = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/api/health', timeout=1).read()
+                elapsed = time.perf_counter() - started
+                break
+            except OSError:
+                time.sleep(0.01)
+        else:
+            raise RuntimeError(f"{' '.join(command)} did not answer within {timeout}s")
+        time.sleep(2)  # let the remaining workers finish booting
+        for _ in range(20):
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/health', timeout=5).read()
+        rss, pss = tree_memory_mb(proc.pid)
+        return elapsed, rss, pss
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure startup time and memory with and without --preload')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--out', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = {'import_app_s': time_import(args.runs)}
+    print(f"📦 import app: {report['import_app_s']:.3f}s")
+    for name, extra in (('no_preload', []), ('preload', ['--preload'])):
+        runs = []
+        for _ in range(args.runs):
+            port = free_port()
+            command = ['gunicorn', 'app:app', '--worker-class', 'gthread', '--workers', str(args.workers),
+                       '--threads', str(args.threads), '--bind', f'127.0.0.1:{port}'] + extra
+            runs.append(time_to_health(command, port))
+        report[name] = {
+            'first_health_s': round(statistics.median(run[0] for run in runs), 3),
+            'rss_mb': round(statistics.median(run[1] for run in runs), 1),
+            'pss_mb': round(statistics.median(run[2] for run in runs), 1),
+        }
+        result = report[name]
+        print(f"🚀 {name:<10} {args.workers} workers: first /api/health after {result['first_health_s']:.3f}s, "
+              f"RSS {result['rss_mb']} MB, PSS {result['pss_mb']} MB")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.out}")
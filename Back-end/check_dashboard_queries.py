@@ -0,0 +1,111 @@
+# check_dashboard_queries.py - Dashboards run a fixed number of SQL statements
+#
+# Builds a throwaway SQLite database, grows the consultation table step by step
+# and counts the statements each dashboard issues (before_cursor_execute), so
+# an N+1 regression (e.g. lazy-loading Consultation.patient per row) fails:
+#   python check_dashboard_queries.py --sizes 10 100 1000
+# Exits with status 1 if any dashboard's count changes between sizes.
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# The app reads its configuration at import, so point it at a scratch database first
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='kalafo-check-'), 'check.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ.setdefault('BCRYPT_POOL_SIZE', '0')
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, insert
+
+from app import (app, db, User, Consultation, bump_counters, reconcile_counters, run_migrations)
+
+DASHBOARDS = {
+    'admin': '/api/dashboard/admin',
+    'doctor': '/api/dashboard/doctor',
+    'patient': '/api/dashboard/patient',
+}
+
+
+def seed_users():
+    users = {}
+    for role, count in (('admin', 1), ('doctor', 3), ('patient', 5)):
+        for i in range(count):
+            user = User(email=f'{role}{i}@check.test', role=role, first_name=role.title(), last_name=str(i))
+            user.set_password('check123')
+            db.session.add(user)
+            users.setdefault(role, []).append(user)
+    db.session.commit()
+    return users
+
+
+def add_consultations(users, count, rng):
+    # Core insert, then reconcile: the ORM events would add statements of their own
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    rows = []
+    for i in range(count):
+        status = rng.choice(['scheduled', 'completed', 'cancelled'])
+        offset = timedelta(hours=i + 1) if status == 'scheduled' else -timedelta(hours=i + 1)
+        rows.append({
+            'patient_id': rng.choice(users['patient']).id,
+            'doctor_id': rng.choice(users['doctor']).id,
+            'scheduled_time': now + offset,
+            'status': status,
+            'created_at': now,
+        })
+    db.session.execute(insert(Consultation), rows)
+    reconcile_counters()
+    bump_counters(db.session.connection(), {'version:users': 1, 'version:consultations': 1})
+    db.session.commit()
+
+
+def count_statements(client, path, token):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get(path, headers=headers)  # warm up the user cache
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(path, headers=headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    if response.status_code != 200:
+        raise SystemExit(f'❌ {path} returned {response.status_code}')
+    return len(statements)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Assert dashboards issue a constant number of SQL statements')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Consultation table sizes to check, in increasing order')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with app.app_context():
+        run_migrations()
+        users = seed_users()
+        tokens = {role: create_access_token(identity=str(users[role][0].id)) for role in DASHBOARDS}
+        client = app.test_client()
+        counts = {role: [] for role in DASHBOARDS}
+        total = 0
+        for size in args.sizes:
+            add_consultations(users, size - total, rng)
+            total = size
+            for role, path in DASHBOARDS.items():
+                counts[role].append(count_statements(client, path, tokens[role]))
+            print(f"📊 {size:>6} consultations: " +
+                  ', '.join(f"{role} {counts[role][-1]}" for role in DASHBOARDS))
+
+    shutil.rmtree(os.path.dirname(DB_PATH), ignore_errors=True)
+    failed = [role for role, values in counts.items() if len(set(values)) > 1]
+    if failed:
+        print(f"❌ Statement count grows with the data for: {', '.join(failed)}")
+        sys.exit(1)
+    print("✅ Every dashboard runs a fixed number of statements")
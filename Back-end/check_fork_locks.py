@@ -0,0 +1,94 @@
+# check_fork_locks.py - A fork never inherits a held lock
+#
+# gunicorn --preload forks workers from a master that may have other threads
+# running. For each module-level lock in app.py (bcrypt pool, replica health,
+# metrics, user cache, event hub), a thread in this process holds it while
+# the process forks. The child then runs the code paths that take every one
+# of those locks and must exit within a few seconds instead of deadlocking:
+#   python check_fork_locks.py
+# Exits with status 1 if any child hangs or fails (Linux/macOS only).
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+# The app reads its configuration at import, so point it at a scratch database first
+WORK_DIR = tempfile.mkdtemp(prefix='kalafo-fork-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORK_DIR, 'fork.db')}"
+os.environ['METRICS_DIR'] = os.path.join(WORK_DIR, 'metrics')
+os.environ.setdefault('BCRYPT_POOL_SIZE', '1')
+
+import app as kalafo
+
+TIMEOUT = 5
+
+LOCKS = {
+    'bcrypt pool': lambda: kalafo._hasher_lock,
+    'replica health': lambda: kalafo._replica_lock,
+    'metrics': lambda: kalafo.metrics._lock,
+    'user cache': lambda: kalafo.user_cache._lock,
+    'event hub': lambda: kalafo.event_hub._lock,
+}
+
+
+def exercise():
+    # Every path below takes one of the locks in LOCKS
+    kalafo.metrics.inc('kalafo_fork_check_total', {})
+    kalafo.metrics.snapshot()
+    kalafo.user_cache.get(1)
+    with kalafo.app.app_context():
+        kalafo.mark_replica_down()
+    pool, _ = kalafo._get_hasher()
+    kalafo._discard_hasher(pool)
+    kalafo.event_hub.unsubscribe(kalafo.EventSubscriber(set()))
+
+
+def fork_while_held(lock):
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with lock:
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=holder, daemon=True)
+    thread.start()
+    held.wait()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            exercise()
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    release.set()
+    thread.join()
+
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            return 'ok' if os.waitstatus_to_exitcode(status) == 0 else 'failed'
+        time.sleep(0.05)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    return 'deadlocked'
+
+
+if __name__ == '__main__':
+    failed = []
+    for name, lock in LOCKS.items():
+        result = fork_while_held(lock())
+        if result == 'ok':
+            print(f"✅ {name}: child ran with the lock held at fork")
+        else:
+            failed.append(name)
+            print(f"❌ {name}: child {result}")
+
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+    print("✅ No lock held at fork time blocks a worker")
@@ -0,0 +1,125 @@
+# check_replica_fallback.py - Reads survive a replica that breaks mid-request
+#
+# Builds a throwaway SQLite primary and a copy of it as DATABASE_READ_URL,
+# lets the health check mark the replica healthy, then drops tables on the
+# replica from inside a request (before_cursor_execute) the way a replica
+# behind the release migration looks. Each route must still answer 200 from
+# the primary, count one fallback and leave the replica marked down:
+#   python check_replica_fallback.py
+# Covers a failure in conditional_get's counters read (outside the view's
+# own error handling) and one in the view's queries. Exits 1 on a failure.
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+# The app reads its configuration at import, so point it at scratch databases first
+WORK_DIR = tempfile.mkdtemp(prefix='kalafo-replica-')
+PRIMARY_PATH = os.path.join(WORK_DIR, 'primary.db')
+REPLICA_PATH = os.path.join(WORK_DIR, 'replica.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{PRIMARY_PATH}'
+os.environ['DATABASE_READ_URL'] = f'sqlite:///{REPLICA_PATH}'
+os.environ['REPLICA_CHECK_INTERVAL'] = '3600'
+os.environ['METRICS_DIR'] = os.path.join(WORK_DIR, 'metrics')
+os.environ.setdefault('BCRYPT_POOL_SIZE', '0')
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app import app, db, User, metrics, run_migrations, _replica_health
+
+ROUTES = ['/api/dashboard/admin', '/api/users', '/api/patients']
+
+CASES = {
+    # conditional_get reads the counters before the view runs
+    'counters read': lambda statement: 'stat_counter' in statement,
+    # the view's own queries, inside its try/except
+    'view query': lambda statement: 'stat_counter' not in statement,
+}
+
+
+def seed():
+    run_migrations()
+    for role in ('admin', 'doctor', 'patient'):
+        user = User(email=f'{role}@check.test', role=role, first_name=role.title(), last_name='Check')
+        user.set_password('check123')
+        db.session.add(user)
+    db.session.commit()
+    return User.query.filter_by(role='admin').one()
+
+
+def fresh_replica():
+    db.engines['replica'].dispose()
+    # The backup API also copies pages still in the primary's WAL
+    with sqlite3.connect(PRIMARY_PATH) as source, sqlite3.connect(REPLICA_PATH) as target:
+        source.backup(target)
+    _replica_health.update(checked=None, healthy=False)
+
+
+def fallbacks():
+    return sum(value for name, labels, value in metrics.snapshot()['counters']
+               if name == 'kalafo_replica_fallbacks_total')
+
+
+def run_case(client, headers, path, breaks_on):
+    replica_statements = []
+    broken = []
+
+    def break_replica(conn, cursor, statement, parameters, context, executemany):
+        replica_statements.append(statement)
+        if not broken and breaks_on(statement):
+            broken.append(statement)
+            # Another connection changes the schema under the request
+            with sqlite3.connect(REPLICA_PATH) as other:
+                for table in (['stat_counter'] if 'stat_counter' in statement else ['consultation', 'user']):
+                    other.execute(f'DROP TABLE "{table}"')
+
+    fresh_replica()
+    expected = client.get(path, headers=headers)  # marks the replica healthy
+    before = fallbacks()
+    event.listen(db.engines['replica'], 'before_cursor_execute', break_replica)
+    try:
+        response = client.get(path, headers=headers)
+        broke_at = len(replica_statements)
+        after = client.get(path, headers=headers)
+    finally:
+        event.remove(db.engines['replica'], 'before_cursor_execute', break_replica)
+
+    problems = []
+    if not broken:
+        problems.append('the replica was never queried')
+    if response.status_code != 200:
+        problems.append(f'returned {response.status_code}')
+    elif response.get_json() != expected.get_json():
+        problems.append('body differs from the replica-served response')
+    if fallbacks() != before + 1:
+        problems.append(f'counted {fallbacks() - before} fallbacks instead of 1')
+    if len(replica_statements) != broke_at:
+        problems.append('the next request still read from the replica')
+    if after.status_code != 200:
+        problems.append(f'the next request returned {after.status_code}')
+    return problems
+
+
+if __name__ == '__main__':
+    failed = False
+    with app.app_context():
+        admin = seed()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(admin.id))}'}
+        client = app.test_client()
+        for case, breaks_on in CASES.items():
+            for path in ROUTES:
+                problems = run_case(client, headers, path, breaks_on)
+                if problems:
+                    failed = True
+                    print(f"❌ {path} ({case}): {'; '.join(problems)}")
+                else:
+                    print(f"✅ {path} ({case}): served from the primary, replica marked down")
+        db.engines['replica'].dispose()
+
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+    print("✅ Every route falls back to the primary when the replica breaks mid-request")
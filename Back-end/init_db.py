@@ -1,10 +1,10 @@
-from app import app, db, User
+from app import app, db, User, run_migrations
 from datetime import datetime
 
 def init_database():
     with app.app_context():
-        # Create all tables
-        db.create_all()
+        # Create all tables and apply pending migrations
+        run_migrations()
         print("✅ Database tables created")
         
         # Check if admin user already exists
@@ -155,6 +155,7 @@ export function clearAuthToken(): void {
     localStorage.removeItem(TOKEN_STORAGE_KEY)
     for (const k of LEGACY_KEYS) localStorage.removeItem(k)
     delete api.defaults.headers.common['Authorization']
+    batchCache.clear()
   } catch (error) {
     console.warn('Failed to clear token from localStorage:', error)
   }
@@ -266,19 +267,244 @@ export async function getAllUsers(
   return response.data
 }
 
+// Batch: several GET requests in one round trip (at most 10). Paths are
+// relative to the API base, e.g. '/me'; each entry keeps its own status.
+export interface BatchResponse<T = unknown> {
+  path: string
+  status: number
+  headers: { ETag?: string }
+  body: T
+}
+
+// Browsers never cache a POST, so batchGet revalidates entries itself: the
+// last ETag and body per path go back as that entry's If-None-Match, and a
+// 304 entry is answered from here instead of re-sending the body.
+const batchCache = new Map<string, { etag: string; body: unknown }>()
+
+export async function batchGet(
+  paths: string[],
+  opts?: { signal?: AbortSignal }
+): Promise<BatchResponse[]> {
+  const response = await api.post<{ responses: BatchResponse[] }>(
+    '/batch',
+    {
+      requests: paths.map((path) => {
+        const cached = batchCache.get(path)
+        return cached
+          ? { path: `/api${path}`, headers: { 'If-None-Match': cached.etag } }
+          : { path: `/api${path}` }
+      }),
+    },
+    { signal: opts?.signal }
+  )
+  return response.data.responses.map((entry, i) => {
+    const path = paths[i]
+    const cached = batchCache.get(path)
+    if (entry.status === 304 && cached) {
+      return { ...entry, status: 200, body: cached.body }
+    }
+    if (entry.status === 200 && entry.headers.ETag) {
+      batchCache.set(path, { etag: entry.headers.ETag, body: entry.body })
+    } else {
+      batchCache.delete(path)
+    }
+    return entry
+  })
+}
+
+function batchBody<T>(entry: BatchResponse): T {
+  if (entry.status !== 200) {
+    const body = entry.body as { error?: string; msg?: string } | null
+    throw new Error(body?.error || body?.msg || `Request to ${entry.path} failed (${entry.status})`)
+  }
+  return entry.body as T
+}
+
+export async function getAdminOverview(
+  opts?: { signal?: AbortSignal }
+): Promise<{ dashboard: AdminDashboardResponse; users: { users: User[] } }> {
+  const [dashboard, users] = await batchGet(['/dashboard/admin', '/users'], opts)
+  return {
+    dashboard: batchBody<AdminDashboardResponse>(dashboard),
+    users: batchBody<{ users: User[] }>(users),
+  }
+}
+
 export interface PatientSummary extends User {
   consultation_count?: number
   last_consultation?: string | null
 }
 
-// Backend returns { patients: PatientSummary[], total_count: number }
-export async function getAllPatients(
+export interface PatientPage {
+  patients: PatientSummary[]
+  total_count: number
+  next_cursor: number | null
+}
+
+// Backend returns one keyset page: pass `next_cursor` back as `after` to continue
+export async function getPatientsPage(
+  params?: { limit?: number; after?: number | null },
+  opts?: { signal?: AbortSignal }
+): Promise<PatientPage> {
+  const response = await api.get<PatientPage>('/patients', {
+    params: {
+      limit: params?.limit,
+      after: params?.after ?? undefined,
+    },
+    signal: opts?.signal,
+  })
+  return response.data
+}
+
+export interface PatientSearchPage {
+  patients: PatientSummary[]
+  next_offset: number | null
+}
+
+// Ranked name/email search: pass `next_offset` back as `offset` to continue
+export async function searchPatients(
+  q: string,
+  params?: { limit?: number; offset?: number },
+  opts?: { signal?: AbortSignal }
+): Promise<PatientSearchPage> {
+  const response = await api.get<PatientSearchPage>('/patients', {
+    params: { q, limit: params?.limit, offset: params?.offset },
+    signal: opts?.signal,
+  })
+  return response.data
+}
+
+// Consultation booking (protected)
+export interface BookedConsultation extends Consultation {
+  scheduled_time: string
+  patient_name?: string | null
+  doctor_name?: string | null
+  created_at?: string
+}
+
+export interface BookConsultationPayload {
+  scheduled_time: string // ISO datetime on a slot boundary
+  doctor_id?: string | number // required unless a doctor books for themselves
+  patient_id?: string | number // required unless a patient books for themselves
+  notes?: string
+}
+
+export interface DoctorSummary {
+  id: string | number
+  first_name: string
+  last_name: string
+}
+
+export interface DoctorSlots {
+  doctor_id: number
+  date: string
+  slot_minutes: number
+  booked: string[]
+}
+
+export async function bookConsultation(
+  body: BookConsultationPayload,
+  opts?: { signal?: AbortSignal }
+): Promise<BookedConsultation> {
+  const response = await api.post<{ consultation: BookedConsultation }>('/consultations', body, {
+    signal: opts?.signal,
+  })
+  return response.data.consultation
+}
+
+export async function rescheduleConsultation(
+  id: string | number,
+  scheduledTime: string,
+  opts?: { signal?: AbortSignal }
+): Promise<BookedConsultation> {
+  const response = await api.put<{ consultation: BookedConsultation }>(
+    `/consultations/${id}`,
+    { scheduled_time: scheduledTime },
+    { signal: opts?.signal }
+  )
+  return response.data.consultation
+}
+
+export async function cancelConsultation(
+  id: string | number,
+  opts?: { signal?: AbortSignal }
+): Promise<BookedConsultation> {
+  const response = await api.post<{ consultation: BookedConsultation }>(
+    `/consultations/${id}/cancel`,
+    {},
+    { signal: opts?.signal }
+  )
+  return response.data.consultation
+}
+
+export interface ConsultationHistoryPage {
+  consultations: (BookedConsultation & { archived: boolean })[]
+  next_cursor: string | null
+}
+
+// Completed/cancelled consultations, archive included: pass `next_cursor` back as `before`
+export async function getConsultationHistory(
+  params?: { limit?: number; before?: string | null; patient_id?: number; doctor_id?: number },
   opts?: { signal?: AbortSignal }
-): Promise<PatientSummary[]> {
-  const response = await api.get<{ patients: PatientSummary[]; total_count: number }>('/patients', { 
-    signal: opts?.signal 
+): Promise<ConsultationHistoryPage> {
+  const response = await api.get<ConsultationHistoryPage>('/consultations/history', {
+    params: {
+      limit: params?.limit,
+      before: params?.before ?? undefined,
+      patient_id: params?.patient_id,
+      doctor_id: params?.doctor_id,
+    },
+    signal: opts?.signal,
   })
-  return response.data.patients
+  return response.data
+}
+
+export interface AnalyticsSummary {
+  total: number
+  completed: number
+  cancelled: number
+  no_show: number
+  scheduled: number
+  completion_rate: number | null
+  cancellation_rate: number | null
+  no_show_rate: number | null
+}
+
+export interface ConsultationAnalytics {
+  from: string
+  to: string
+  totals: AnalyticsSummary
+  days: (AnalyticsSummary & { day: string })[]
+  doctors: (AnalyticsSummary & { doctor_id: number; doctor_name: string | null })[]
+}
+
+// Dates are YYYY-MM-DD, `to` exclusive; doctors always get their own numbers
+export async function getConsultationAnalytics(
+  params?: { from?: string; to?: string; doctor_id?: number },
+  opts?: { signal?: AbortSignal }
+): Promise<ConsultationAnalytics> {
+  const response = await api.get<ConsultationAnalytics>('/analytics/consultations', {
+    params,
+    signal: opts?.signal,
+  })
+  return response.data
+}
+
+export async function getDoctors(opts?: { signal?: AbortSignal }): Promise<DoctorSummary[]> {
+  const response = await api.get<{ doctors: DoctorSummary[] }>('/doctors', { signal: opts?.signal })
+  return response.data.doctors
+}
+
+export async function getDoctorSlots(
+  doctorId: string | number,
+  date: string,
+  opts?: { signal?: AbortSignal }
+): Promise<DoctorSlots> {
+  const response = await api.get<DoctorSlots>(`/doctors/${doctorId}/slots`, {
+    params: { date },
+    signal: opts?.signal,
+  })
+  return response.data
 }
 
 // Helper to humanize field names from the API for error messages
@@ -348,4 +574,35 @@ export function getApiErrorMessage(err: unknown): string {
 const existingToken = getAuthToken()
 if (existingToken) {
   api.defaults.headers.common['Authorization'] = `Bearer ${existingToken}`
-}
\ No newline at end of file
+}
+
+export interface ConsultationEvent {
+  id: number
+  type: 'consultation.created' | 'consultation.status' | 'consultation.rescheduled'
+  consultation_id: number
+  patient_id: number
+  doctor_id: number
+  status: string | null
+  previous_status: string | null
+  scheduled_time: string | null
+  created_at: string | null
+}
+
+// Live consultation changes over SSE. EventSource can't send headers, so the
+// token goes in the query string; the browser reconnects on its own and sends
+// Last-Event-ID to replay what it missed. Returns a function that closes it.
+export function subscribeConsultationEvents(
+  onEvent: (event: ConsultationEvent) => void
+): () => void {
+  const token = getAuthToken()
+  if (!token || typeof EventSource === 'undefined') return () => {}
+  const source = new EventSource(`${BASE_URL}/events?jwt=${encodeURIComponent(token)}`)
+  const handler = (e: MessageEvent) => onEvent(JSON.parse(e.data) as ConsultationEvent)
+  const types: ConsultationEvent['type'][] = [
+    'consultation.created',
+    'consultation.status',
+    'consultation.rescheduled',
+  ]
+  types.forEach((type) => source.addEventListener(type, handler as EventListener))
+  return () => source.close()
+}
@@ -1,7 +1,7 @@
 import { createFileRoute } from '@tanstack/react-router'
 import { useQuery } from '@tanstack/react-query'
 import { useState, useMemo } from 'react'
-import { getAdminDashboard, getAllUsers } from '@/api/kalafo'
+import { getAdminOverview } from '@/api/kalafo'
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card'
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table'
 import { Badge } from '@/components/ui/badge'
@@ -22,19 +22,18 @@ function RouteComponent() {
   const [currentPage, setCurrentPage] = useState(1)
   const [itemsPerPage, setItemsPerPage] = useState(10)
 
-  const { data: dashboardData, isLoading: isDashboardLoading, isFetching: isDashboardFetching, refetch: refetchDashboard } = useQuery({
-    queryKey: ['admin-dashboard'],
-    queryFn: () => getAdminDashboard(),
+  // Stats and users arrive together in one /batch round trip; unchanged
+  // entries come back as 304s and are filled in from batchGet's cache
+  const { data: overview, isLoading: isDashboardLoading, isFetching: isRefreshing, refetch } = useQuery({
+    queryKey: ['admin-overview'],
+    queryFn: () => getAdminOverview(),
   })
 
-  const { data: usersData, isLoading: isUsersLoading, isFetching: isUsersFetching, refetch: refetchUsers } = useQuery({
-    queryKey: ['all-users'],
-    queryFn: () => getAllUsers(),
-  })
-
-  const isRefreshing = isDashboardFetching || isUsersFetching
+  const dashboardData = overview?.dashboard
+  const usersData = overview?.users
+  const isUsersLoading = isDashboardLoading
   const handleRefresh = async () => {
-    await Promise.all([refetchDashboard(), refetchUsers()])
+    await refetch()
   }
 
   const stats = dashboardData?.stats
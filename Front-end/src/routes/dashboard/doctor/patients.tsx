@@ -1,53 +1,70 @@
 import { createFileRoute } from '@tanstack/react-router'
-import { useQuery } from '@tanstack/react-query'
-import { useMemo, useState } from 'react'
-import { getAllPatients, type PatientSummary } from '@/api/kalafo'
+import { useInfiniteQuery } from '@tanstack/react-query'
+import { useEffect, useMemo, useState } from 'react'
+import { getPatientsPage, searchPatients, type PatientSummary } from '@/api/kalafo'
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card'
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table'
 import { Badge } from '@/components/ui/badge'
 import { Input } from '@/components/ui/input'
 import { Button } from '@/components/ui/button'
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select'
-import { Users, Activity, History, Loader2, Search, ChevronLeft, ChevronRight, RefreshCw } from 'lucide-react'
+import { Users, Activity, History, Loader2, Search, ChevronDown, RefreshCw } from 'lucide-react'
 import { format } from 'date-fns'
 
 export const Route = createFileRoute('/dashboard/doctor/patients')({
   component: RouteComponent,
 })
 
+const PAGE_SIZE = 50
+
 function RouteComponent() {
   const [searchQuery, setSearchQuery] = useState('')
+  const [searchTerm, setSearchTerm] = useState('')
   const [statusFilter, setStatusFilter] = useState<'all' | 'active' | 'inactive'>('all')
   const [activityFilter, setActivityFilter] = useState<'all' | 'with' | 'without'>('all')
-  const [currentPage, setCurrentPage] = useState(1)
-  const [itemsPerPage, setItemsPerPage] = useState(10)
 
-  const { data, isLoading, isFetching, refetch } = useQuery({
+  // Wait for typing to pause before asking the server to search
+  useEffect(() => {
+    const timer = setTimeout(() => setSearchTerm(searchQuery.trim()), 300)
+    return () => clearTimeout(timer)
+  }, [searchQuery])
+
+  // The list is loaded one keyset page at a time; "Load more" fetches the next
+  const browse = useInfiniteQuery({
     queryKey: ['doctor-patients'],
-    queryFn: () => getAllPatients(),
+    queryFn: ({ pageParam, signal }) => getPatientsPage({ limit: PAGE_SIZE, after: pageParam }, { signal }),
+    initialPageParam: null as number | null,
+    getNextPageParam: (page) => page.next_cursor,
+    enabled: !searchTerm,
     staleTime: 5 * 60 * 1000,
   })
 
-  const patients: PatientSummary[] = data ?? []
+  // Search runs on the server over every patient, ranked, paged by offset
+  const search = useInfiniteQuery({
+    queryKey: ['doctor-patients', 'search', searchTerm],
+    queryFn: ({ pageParam, signal }) => searchPatients(searchTerm, { limit: PAGE_SIZE, offset: pageParam }, { signal }),
+    initialPageParam: 0,
+    getNextPageParam: (page) => page.next_offset,
+    enabled: Boolean(searchTerm),
+  })
+
+  const { isLoading, isFetching, refetch, hasNextPage, fetchNextPage, isFetchingNextPage } = searchTerm ? search : browse
+
+  const pages: { patients: PatientSummary[] }[] = (searchTerm ? search.data?.pages : browse.data?.pages) ?? []
+  const patients: PatientSummary[] = useMemo(() => pages.flatMap((page) => page.patients), [pages])
 
-  // Derived stats for header cards
-  const totalPatients = patients.length
-  const activePatients = useMemo(() => patients.filter(p => p.is_active).length, [patients])
-  const withConsultations = useMemo(() => patients.filter(p => (p.consultation_count ?? 0) > 0).length, [patients])
+  // Derived stats for header cards: the total comes from the server's
+  // counter, the other two from the pages loaded so far
+  const loadedPatients = browse.data?.pages.flatMap((page) => page.patients) ?? []
+  const totalPatients = browse.data?.pages[0]?.total_count ?? 0
+  const activePatients = loadedPatients.filter(p => p.is_active).length
+  const withConsultations = loadedPatients.filter(p => (p.consultation_count ?? 0) > 0).length
 
-  // Client-side search + filters
+  // Status and activity filters apply to the loaded rows; search results are not filtered further
   const filtered = useMemo(() => {
     let result = [...patients]
 
-    if (searchQuery.trim()) {
-      const q = searchQuery.toLowerCase()
-      result = result.filter((p) =>
-        p.first_name?.toLowerCase().includes(q) ||
-        p.last_name?.toLowerCase().includes(q) ||
-        p.email?.toLowerCase().includes(q) ||
-        `${p.first_name} ${p.last_name}`.toLowerCase().includes(q)
-      )
-      // search should not chain on other filters
+    if (searchTerm) {
       return result
     }
 
@@ -65,17 +82,7 @@ function RouteComponent() {
     }
 
     return result
-  }, [patients, searchQuery, statusFilter, activityFilter])
-
-  // Pagination
-  const totalPages = Math.max(1, Math.ceil(filtered.length / itemsPerPage))
-  const paginated = useMemo(() => {
-    const start = (currentPage - 1) * itemsPerPage
-    const end = start + itemsPerPage
-    return filtered.slice(start, end)
-  }, [filtered, currentPage, itemsPerPage])
-
-  const handleFilterChange = () => setCurrentPage(1)
+  }, [patients, searchTerm, statusFilter, activityFilter])
 
   const roleAvatarBg = 'bg-sky-600' // all are patients
 
@@ -109,7 +116,7 @@ function RouteComponent() {
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold text-gray-900">{activePatients}</div>
-              <p className="text-xs text-gray-500 mt-1">Active accounts</p>
+              <p className="text-xs text-gray-500 mt-1">Active accounts among {loadedPatients.length} loaded</p>
             </CardContent>
           </Card>
 
@@ -120,7 +127,7 @@ function RouteComponent() {
             </CardHeader>
             <CardContent>
               <div className="text-2xl font-bold text-gray-900">{withConsultations}</div>
-              <p className="text-xs text-gray-500 mt-1">Has at least one consult</p>
+              <p className="text-xs text-gray-500 mt-1">Of {loadedPatients.length} loaded patients</p>
             </CardContent>
           </Card>
         </div>
@@ -131,8 +138,9 @@ function RouteComponent() {
             <div>
               <CardTitle>Patients</CardTitle>
               <CardDescription className="transition-opacity duration-300">
-                Showing {paginated.length} of {filtered.length} patients
-                {filtered.length !== patients.length && ` (filtered from ${patients.length} total)`}
+                {searchTerm
+                  ? `Showing ${filtered.length} matching patients`
+                  : `Showing ${filtered.length} of ${patients.length} loaded patients (${totalPatients} total)`}
               </CardDescription>
             </div>
             <Button
@@ -160,7 +168,6 @@ function RouteComponent() {
                     // search clears other filters
                     setStatusFilter('all')
                     setActivityFilter('all')
-                    handleFilterChange()
                   }}
                   className="pl-9 transition-all duration-200 focus:ring-2 focus:ring-teal-500"
                 />
@@ -170,7 +177,6 @@ function RouteComponent() {
                 value={statusFilter}
                 onValueChange={(v) => {
                   setStatusFilter(v as typeof statusFilter)
-                  handleFilterChange()
                 }}
               >
                 <SelectTrigger className="w-full sm:w-[180px] transition-all duration-200">
@@ -187,7 +193,6 @@ function RouteComponent() {
                 value={activityFilter}
                 onValueChange={(v) => {
                   setActivityFilter(v as typeof activityFilter)
-                  handleFilterChange()
                 }}
               >
                 <SelectTrigger className="w-full sm:w-[220px] transition-all duration-200">
@@ -207,7 +212,7 @@ function RouteComponent() {
                 <div className="flex items-center justify-center py-12 animate-in fade-in duration-300">
                   <Loader2 className="h-6 w-6 animate-spin text-teal-600" />
                 </div>
-              ) : filtered.length === 0 ? (
+              ) : filtered.length === 0 && !hasNextPage ? (
                 <div className="text-center py-12 text-gray-500 animate-in fade-in zoom-in-95 duration-300">
                   {searchQuery || statusFilter !== 'all' || activityFilter !== 'all'
                     ? 'No patients match your filters'
@@ -229,11 +234,11 @@ function RouteComponent() {
                         </TableRow>
                       </TableHeader>
                       <TableBody>
-                        {paginated.map((p, index) => (
+                        {filtered.map((p, index) => (
                           <TableRow
                             key={p.id}
                             className="transition-all duration-200 hover:bg-slate-50 animate-in fade-in slide-in-from-left-2"
-                            style={{ animationDelay: `${index * 50}ms`, animationDuration: '300ms' }}
+                            style={{ animationDelay: `${(index % PAGE_SIZE) * 50}ms`, animationDuration: '300ms' }}
                           >
                             <TableCell className="font-medium text-gray-600">{p.id}</TableCell>
                             <TableCell>
@@ -273,55 +278,25 @@ function RouteComponent() {
                     </Table>
                   </div>
 
-                  {/* Pagination */}
-                  <div className="flex flex-col sm:flex-row items-center justify-between gap-4 pt-4 animate-in fade-in slide-in-from-bottom-2 duration-300 delay-150">
-                    <div className="flex items-center gap-2">
-                      <span className="text-sm text-gray-600">Rows per page:</span>
-                      <Select
-                        value={String(itemsPerPage)}
-                        onValueChange={(v) => {
-                          setItemsPerPage(Number(v))
-                          setCurrentPage(1)
-                        }}
+                  {/* Load more */}
+                  {hasNextPage && (
+                    <div className="flex justify-center pt-4 animate-in fade-in slide-in-from-bottom-2 duration-300 delay-150">
+                      <Button
+                        variant="outline"
+                        size="sm"
+                        onClick={() => fetchNextPage()}
+                        disabled={isFetchingNextPage}
+                        className="transition-all duration-200 hover:scale-105 disabled:hover:scale-100"
                       >
-                        <SelectTrigger className="w-[80px]">
-                          <SelectValue />
-                        </SelectTrigger>
-                        <SelectContent>
-                          <SelectItem value="5">5</SelectItem>
-                          <SelectItem value="10">10</SelectItem>
-                          <SelectItem value="20">20</SelectItem>
-                          <SelectItem value="50">50</SelectItem>
-                        </SelectContent>
-                      </Select>
+                        {isFetchingNextPage ? (
+                          <Loader2 className="h-4 w-4 mr-2 animate-spin" />
+                        ) : (
+                          <ChevronDown className="h-4 w-4 mr-2" />
+                        )}
+                        Load more
+                      </Button>
                     </div>
-
-                    <div className="flex items-center gap-2">
-                      <span className="text-sm text-gray-600">
-                        Page {currentPage} of {totalPages}
-                      </span>
-                      <div className="flex gap-1">
-                        <Button
-                          variant="outline"
-                          size="sm"
-                          onClick={() => setCurrentPage((p) => Math.max(1, p - 1))}
-                          disabled={currentPage === 1}
-                          className="transition-all duration-200 hover:scale-105 disabled:hover:scale-100"
-                        >
-                          <ChevronLeft className="h-4 w-4" />
-                        </Button>
-                        <Button
-                          variant="outline"
-                          size="sm"
-                          onClick={() => setCurrentPage((p) => Math.min(totalPages, p + 1))}
-                          disabled={currentPage === totalPages}
-                          className="transition-all duration-200 hover:scale-105 disabled:hover:scale-100"
-                        >
-                          <ChevronRight className="h-4 w-4" />
-                        </Button>
-                      </div>
-                    </div>
-                  </div>
+                  )}
                 </div>
               )}
             </div>
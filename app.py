@@ -1,12 +1,47 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify, make_response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as RoutingBaseSession
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity, get_jwt
+from sqlalchemy import and_, bindparam, case, event, false, func, insert, inspect, literal, or_, select, text, true, union_all
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, aliased, object_session
 import bcrypt
+import click
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
+import json
+import math
+import multiprocessing
 import os
-from datetime import datetime, timedelta
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
 from dotenv import load_dotenv
 from functools import wraps
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib json module is the fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, responses fall back to gzip
+    brotli = None
 
 # Load environment variables
 load_dotenv()
@@ -19,25 +54,268 @@ app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-chan
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///kalafo.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+app.config['PAGE_SIZE_DEFAULT'] = int(os.getenv('PAGE_SIZE_DEFAULT', 100))
+app.config['PAGE_SIZE_MAX'] = int(os.getenv('PAGE_SIZE_MAX', 500))
+# Patient search takes at most this many candidates from each index (see patient_search_query)
+app.config['SEARCH_MAX_MATCHES'] = int(os.getenv('SEARCH_MAX_MATCHES', 1000))
+app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 10000))
+app.config['USER_CACHE_TTL'] = float(os.getenv('USER_CACHE_TTL', 60))
+app.config['CONSULTATION_SLOT_MINUTES'] = int(os.getenv('CONSULTATION_SLOT_MINUTES', 30))
+# Completed/cancelled consultations older than this move to consultation_archive
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+# Longest list a dashboard returns; the rest is in /api/consultations/history
+app.config['DASHBOARD_LIST_LIMIT'] = int(os.getenv('DASHBOARD_LIST_LIMIT', 50))
+# Longest date range /api/analytics/consultations accepts
+app.config['ANALYTICS_MAX_DAYS'] = int(os.getenv('ANALYTICS_MAX_DAYS', 366))
+app.config['EXPORT_CHUNK_SIZE'] = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+app.config['IMPORT_BATCH_SIZE'] = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+app.config['IMPORT_HASH_WORKERS'] = int(os.getenv('IMPORT_HASH_WORKERS', 2))
+app.config['IMPORT_MAX_HASHES'] = int(os.getenv('IMPORT_MAX_HASHES', 100))
+app.config['BATCH_MAX_REQUESTS'] = int(os.getenv('BATCH_MAX_REQUESTS', 10))
+# Compress JSON/text responses of at least this many bytes (0 disables)
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+app.config['BCRYPT_ROUNDS'] = int(os.getenv('BCRYPT_ROUNDS', 12))
+# Processes per worker for bcrypt; 0 hashes inline in the request thread
+app.config['BCRYPT_POOL_SIZE'] = int(os.getenv('BCRYPT_POOL_SIZE', 2))
+app.config['BCRYPT_QUEUE_TIMEOUT'] = float(os.getenv('BCRYPT_QUEUE_TIMEOUT', 1))
+# Login token buckets (see Login throttling); a burst of 0 disables a bucket
+app.config['LOGIN_THROTTLE_DB'] = os.getenv('LOGIN_THROTTLE_DB', os.path.join(tempfile.gettempdir(), 'kalafo-login-throttle.db'))
+app.config['LOGIN_IP_BURST'] = int(os.getenv('LOGIN_IP_BURST', 20))
+app.config['LOGIN_IP_PER_MINUTE'] = float(os.getenv('LOGIN_IP_PER_MINUTE', 10))
+app.config['LOGIN_ACCOUNT_BURST'] = int(os.getenv('LOGIN_ACCOUNT_BURST', 5))
+app.config['LOGIN_ACCOUNT_PER_MINUTE'] = float(os.getenv('LOGIN_ACCOUNT_PER_MINUTE', 2))
+# Reverse proxies in front of the app whose X-Forwarded-For is trusted (0 = none)
+app.config['TRUSTED_PROXY_HOPS'] = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+# Each worker writes its metrics here; /api/metrics sums every worker's file.
+# Clear it on deploy, as with prometheus_client's multiprocess mode.
+app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'kalafo-metrics'))
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+# Log statements slower than this many milliseconds (unset disables the log)
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS')) if os.getenv('SLOW_QUERY_MS') else None
+# Opt-in: decide role checks from the JWT 'role' claim without loading the user
+app.config['AUTH_TRUST_TOKEN_CLAIMS'] = os.getenv('AUTH_TRUST_TOKEN_CLAIMS', 'false').lower() in ('1', 'true', 'yes')
+
+# Database engine tuning. SQLite gets WAL (readers no longer wait on the
+# writer), a busy timeout instead of immediate 'database is locked' errors and
+# memory-mapped reads. Server databases get a tunable connection pool.
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+       return {'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    return {
+       'pool_size': app.config['DB_POOL_SIZE'],
+       'max_overflow': app.config['DB_MAX_OVERFLOW'],
+       'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+       'pool_recycle': app.config['DB_POOL_RECYCLE'],
+       'pool_pre_ping': app.config['DB_POOL_PRE_PING']
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# Optional read-only replica for the dashboard/list routes (see read_replica)
+app.config['DATABASE_READ_URL'] = os.getenv('DATABASE_READ_URL')
+app.config['REPLICA_CHECK_INTERVAL'] = float(os.getenv('REPLICA_CHECK_INTERVAL', 5))
+if app.config['DATABASE_READ_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {
+       'replica': {'url': app.config['DATABASE_READ_URL'], **engine_options(app.config['DATABASE_READ_URL'])}
+    }
+
+# Server-sent events (see Live events). Seconds unless noted.
+app.config['EVENTS_POLL_INTERVAL'] = float(os.getenv('EVENTS_POLL_INTERVAL', 1))
+app.config['EVENTS_HEARTBEAT'] = float(os.getenv('EVENTS_HEARTBEAT', 15))
+app.config['EVENTS_RETENTION'] = int(os.getenv('EVENTS_RETENTION', 3600))
+app.config['EVENTS_QUEUE_SIZE'] = int(os.getenv('EVENTS_QUEUE_SIZE', 100))  # events buffered per stream
+app.config['EVENTS_REPLAY_LIMIT'] = int(os.getenv('EVENTS_REPLAY_LIMIT', 500))
+
+def sqlite_pragmas():
+    return [
+       f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}",
+       f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}",
+       f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}",
+       f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}",
+    ]
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+       return
+    cursor = dbapi_connection.cursor()
+    try:
+       for pragma in sqlite_pragmas():
+          cursor.execute(pragma)
+    finally:
+       cursor.close()
+
+class RoutingSession(RoutingBaseSession):
+    # Sends reads to the replica inside routes marked with @read_replica.
+    # Flushes (and so every write) always go to the primary.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+       if bind is None and not self._flushing and has_request_context() and g.get('read_replica'):
+          return self._db.engines['replica']
+       return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+# JSON
+
+class FastJSONProvider(DefaultJSONProvider):
+    # orjson when installed, otherwise the stdlib. Either way the output
+    # matches the default provider (sorted keys, compact) except that any
+    # datetime left in a payload is written as ISO 8601. to_dict() still
+    # returns ISO strings, so its output is safe for plain json.dumps too.
+    # orjson writes UTF-8 instead of \u escapes.
+    use_orjson = orjson is not None
+
+    @staticmethod
+    def default(o):
+       if isinstance(o, (datetime, date)):
+          return o.isoformat()
+       return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+       if self.use_orjson and not kwargs.get('indent'):
+          return self._orjson_dumps(obj).decode('utf-8')
+       kwargs.setdefault('default', self.default)
+       kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+       kwargs.setdefault('sort_keys', self.sort_keys)
+       return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+       if self.use_orjson and not kwargs:
+          return orjson.loads(s)
+       return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+       if not self.use_orjson or (self.compact is None and self._app.debug) or self.compact is False:
+          return super().response(*args, **kwargs)
+       obj = self._prepare_response_obj(args, kwargs)
+       return self._app.response_class(self._orjson_dumps(obj) + b'\n', mimetype=self.mimetype)
+
+    def _orjson_dumps(self, obj):
+       return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+app.json = FastJSONProvider(app)
+
+# Client addresses (login throttling) come from X-Forwarded-For behind a proxy
+if app.config['TRUSTED_PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'])
 
 # Initialize extensions
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 jwt = JWTManager(app)
 
+CORS_ORIGINS = [
+    "http://localhost:3000",
+    "http://localhost:5173",
+    "https://kalafo.com",
+    "https://www.kalafo.com",
+    "https://kalafo.vercel.app",
+    "https://*.vercel.app"
+]
+
 CORS(app,
-    origins=[
-        "http://localhost:3000",
-        "http://localhost:5173",
-        "https://kalafo.com",
-        "https://www.kalafo.com",
-        "https://kalafo.vercel.app",
-        "https://*.vercel.app"
-    ],
+    origins=CORS_ORIGINS,
     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Authorization"],
     supports_credentials=True
 )
 
+# Password hashing
+
+# bcrypt is CPU-bound, so it runs in a small process pool per worker. At most
+# BCRYPT_POOL_SIZE hashes are in flight; further callers wait up to
+# BCRYPT_QUEUE_TIMEOUT for a slot and then get PasswordHasherBusy, which the
+# routes turn into a 503 instead of piling up behind the hashing backlog.
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+_hasher = {'pid': None, 'pool': None, 'slots': None}
+_hasher_lock = threading.Lock()
+
+def _get_hasher():
+    # Created lazily and per process, so pre-fork parents never share a pool
+    with _hasher_lock:
+       if _hasher['pid'] != os.getpid():
+          _hasher['pool'] = None
+          _hasher['slots'] = threading.BoundedSemaphore(app.config['BCRYPT_POOL_SIZE'])
+          _hasher['pid'] = os.getpid()
+       if _hasher['pool'] is None:
+          _hasher['pool'] = ProcessPoolExecutor(app.config['BCRYPT_POOL_SIZE'],
+                                                mp_context=multiprocessing.get_context('spawn'))
+       return _hasher['pool'], _hasher['slots']
+
+def _discard_hasher(pool):
+    # A pool stays broken once one of its processes dies (OOM kill, segfault),
+    # so drop it and let the next _get_hasher() start a fresh one
+    with _hasher_lock:
+       if _hasher['pool'] is pool:
+          _hasher['pool'] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _submit_hash(pool, fn, *args):
+    try:
+       return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+       app.logger.warning("bcrypt pool broken, restarting it")
+       _discard_hasher(pool)
+       pool, _ = _get_hasher()
+       return pool.submit(fn, *args).result()
+
+def _run_hasher(fn, *args):
+    if app.config['BCRYPT_POOL_SIZE'] <= 0:
+       return fn(*args)
+    pool, slots = _get_hasher()
+    if not slots.acquire(timeout=app.config['BCRYPT_QUEUE_TIMEOUT']):
+       raise PasswordHasherBusy()
+    try:
+       return _submit_hash(pool, fn, *args)
+    finally:
+       slots.release()
+
+def hash_password(password):
+    salt = bcrypt.gensalt(app.config['BCRYPT_ROUNDS'])
+    return _run_hasher(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+def verify_password(password, password_hash):
+    return _run_hasher(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def hash_passwords(passwords):
+    # Bulk variant for imports. It runs on a pool of its own for the length of
+    # the import, so logins never queue behind thousands of import hashes
+    rounds = app.config['BCRYPT_ROUNDS']
+    encoded = [password.encode('utf-8') for password in passwords]
+    salts = [bcrypt.gensalt(rounds) for _ in passwords]
+    workers = min(app.config['IMPORT_HASH_WORKERS'], len(passwords))
+    if workers <= 1:
+       return [bcrypt.hashpw(password, salt).decode('utf-8') for password, salt in zip(encoded, salts)]
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+       return [h.decode('utf-8') for h in pool.map(bcrypt.hashpw, encoded, salts, chunksize=32)]
+
+def password_needs_rehash(password_hash):
+    # bcrypt hashes look like $2b$<cost>$<salt+digest>
+    try:
+       return int(password_hash.split('$')[2]) != app.config['BCRYPT_ROUNDS']
+    except (IndexError, ValueError):
+       return True
+
+def busy_response():
+    response = jsonify({'error': 'Server busy, please retry'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 # Models
 
 class User(db.Model):
@@ -51,10 +329,10 @@ class User(db.Model):
     is_active = db.Column(db.Boolean, default=True)
 
     def set_password(self, password):
-       self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+       self.password_hash = hash_password(password)
 
     def check_password(self, password):
-       return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+       return verify_password(password, self.password_hash)
 
     def to_dict(self):
        return {
@@ -81,20 +359,806 @@ class Consultation(db.Model):
     patient = db.relationship('User', foreign_keys=[patient_id], backref='patient_consultations')
     doctor = db.relationship('User', foreign_keys=[doctor_id], backref='doctor_consultations')
 
+    # Keep in sync with MIGRATIONS below so existing databases get them too
+    __table_args__ = (
+       db.Index('ix_consultation_doctor_status_time', 'doctor_id', 'status', 'scheduled_time'),
+       db.Index('ix_consultation_patient_status_time', 'patient_id', 'status', 'scheduled_time'),
+       db.Index('ix_consultation_created_at', 'created_at'),
+       db.Index('ix_consultation_status_time', 'status', 'scheduled_time'),
+       # A doctor can hold one scheduled consultation per slot; concurrent
+       # bookings of the same slot race on this index and exactly one wins
+       db.Index('uq_consultation_doctor_slot', 'doctor_id', 'scheduled_time', unique=True,
+                sqlite_where=text("status = 'scheduled'"),
+                postgresql_where=text("status = 'scheduled'")),
+    )
+
+    def to_dict(self):
+       return consultation_dict(
+          self,
+          f"{self.patient.first_name} {self.patient.last_name}" if self.patient else None,
+          f"Dr. {self.doctor.first_name} {self.doctor.last_name}" if self.doctor else None
+       )
+
+
+class ConsultationArchive(db.Model):
+    # Cold storage for old completed/cancelled consultations, see Archive below.
+    # Rows keep their consultation id.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    scheduled_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20))
+    notes = db.Column(db.Text)
+    diagnosis = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+       db.Index('ix_consultation_archive_patient_time', 'patient_id', 'scheduled_time'),
+       db.Index('ix_consultation_archive_doctor_time', 'doctor_id', 'scheduled_time'),
+    )
+
+
+def consultation_dict(c, patient_name, doctor_name):
+    return {
+       'id': c.id,
+       'patient_id': c.patient_id,
+       'doctor_id': c.doctor_id,
+       'patient_name': patient_name,
+       'doctor_name': doctor_name,
+       'scheduled_time': c.scheduled_time.isoformat() if c.scheduled_time else None,
+       'status': c.status,
+       'notes': c.notes,
+       'diagnosis': c.diagnosis,
+       'created_at': c.created_at.isoformat() if c.created_at else None
+    }
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StatCounter(db.Model):
+    name = db.Column(db.String(80), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ConsultationDailyStat(db.Model):
+    # Consultations per doctor, day and status, see Counters below
+    doctor_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+       db.Index('ix_consultation_daily_stat_day', 'day'),
+    )
+
+class ConsultationEvent(db.Model):
+    # Outbox for /api/events, see Live events below
+    id = db.Column(db.Integer, primary_key=True)
+    consultation_id = db.Column(db.Integer, nullable=False)
+    patient_id = db.Column(db.Integer, nullable=False)
+    doctor_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # created, status, rescheduled
+    status = db.Column(db.String(20))
+    previous_status = db.Column(db.String(20))
+    scheduled_time = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
     def to_dict(self):
        return {
           'id': self.id,
+          'type': f'consultation.{self.kind}',
+          'consultation_id': self.consultation_id,
           'patient_id': self.patient_id,
           'doctor_id': self.doctor_id,
-          'patient_name': f"{self.patient.first_name} {self.patient.last_name}" if self.patient else None,
-          'doctor_name': f"Dr. {self.doctor.first_name} {self.doctor.last_name}" if self.doctor else None,
-          'scheduled_time': self.scheduled_time.isoformat() if self.scheduled_time else None,
           'status': self.status,
-          'notes': self.notes,
-          'diagnosis': self.diagnosis,
+          'previous_status': self.previous_status,
+          'scheduled_time': self.scheduled_time.isoformat() if self.scheduled_time else None,
           'created_at': self.created_at.isoformat() if self.created_at else None
        }
 
+# Counters
+
+# Row counts for the admin dashboard, kept current by the mapper events below
+# inside the same transaction as the change. Keys: 'users:<role>',
+# 'consultations' and 'consultations:<status>' (archived rows included). The same events bump change
+# versions used for ETags: 'version:users', 'version:consultations' and
+# 'version:user:<id>' for every user whose dashboard a change touches. Writes
+# that bypass the ORM unit of work (bulk inserts, raw SQL) must call
+# bump_counters() themselves.
+#
+# consultation_daily_stat is maintained the same way: one row per (doctor_id,
+# day of scheduled_time, status), adjusted by bump_daily_stats(), so the
+# analytics endpoint sums a few rows per doctor-day instead of scanning
+# consultations. Archiving moves rows without touching either, and
+# reconcile_counters() rebuilds both with set-based GROUP BYs.
+
+RECONCILE_COUNTERS_SQL = [
+    "DELETE FROM stat_counter WHERE name LIKE 'users:%' OR name LIKE 'consultations%'",
+    "INSERT INTO stat_counter (name, value) "
+    "SELECT 'users:' || role, COUNT(*) FROM \"user\" GROUP BY role",
+    "INSERT INTO stat_counter (name, value) SELECT 'consultations', "
+    "(SELECT COUNT(*) FROM consultation) + (SELECT COUNT(*) FROM consultation_archive)",
+    "INSERT INTO stat_counter (name, value) "
+    "SELECT 'consultations:' || status, COUNT(*) FROM "
+    "(SELECT status FROM consultation UNION ALL SELECT status FROM consultation_archive) AS c "
+    "WHERE status IS NOT NULL GROUP BY status",
+]
+
+REBUILD_DAILY_STATS_SQL = [
+    "DELETE FROM consultation_daily_stat",
+    "INSERT INTO consultation_daily_stat (doctor_id, day, status, count) "
+    "SELECT doctor_id, date(scheduled_time), status, COUNT(*) FROM "
+    "(SELECT doctor_id, scheduled_time, status FROM consultation "
+    "UNION ALL SELECT doctor_id, scheduled_time, status FROM consultation_archive) AS c "
+    "WHERE status IS NOT NULL GROUP BY doctor_id, date(scheduled_time), status",
+]
+
+DAILY_STAT_UPSERT = text(
+    "INSERT INTO consultation_daily_stat (doctor_id, day, status, count) "
+    "VALUES (:doctor_id, :day, :status, :delta) "
+    "ON CONFLICT (doctor_id, day, status) DO UPDATE "
+    "SET count = consultation_daily_stat.count + excluded.count"
+).bindparams(bindparam('day', type_=db.Date))
+
+def bump_counters(connection, deltas):
+    params = [{'name': name, 'delta': delta} for name, delta in deltas.items() if delta]
+    if not params:
+       return
+    connection.execute(text(
+       "INSERT INTO stat_counter (name, value) VALUES (:name, :delta) "
+       "ON CONFLICT (name) DO UPDATE SET value = stat_counter.value + excluded.value"
+    ), params)
+
+def bump_daily_stats(connection, deltas):
+    # deltas: {(doctor_id, day, status): change}
+    params = [{'doctor_id': doctor_id, 'day': day, 'status': status, 'delta': delta}
+              for (doctor_id, day, status), delta in deltas.items() if delta]
+    if params:
+       connection.execute(DAILY_STAT_UPSERT, params)
+
+def daily_stat_key(doctor_id, scheduled_time, status):
+    if doctor_id is None or scheduled_time is None or not status:
+       return None
+    return doctor_id, scheduled_time.date(), status
+
+def counters_query(*names):
+    return select(StatCounter.name, StatCounter.value).where(StatCounter.name.in_(names))
+
+def counter_values(rows, names):
+    values = dict(rows)
+    return {name: values.get(name, 0) for name in names}
+
+def read_counters(*names):
+    return counter_values(db.session.execute(counters_query(*names)).all(), names)
+
+def reconcile_counters():
+    try:
+       for statement in RECONCILE_COUNTERS_SQL + REBUILD_DAILY_STATS_SQL:
+          db.session.execute(text(statement))
+       db.session.commit()
+    except Exception:
+       db.session.rollback()
+       raise
+
+def _changed(target, attr):
+    history = inspect(target).attrs[attr].history
+    if not history.has_changes():
+       return None
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    return old, new
+
+def _version_deltas(table, *user_ids):
+    deltas = {f'version:{table}': 1}
+    for user_id in user_ids:
+       if user_id is not None:
+          deltas[f'version:user:{user_id}'] = 1
+    return deltas
+
+@event.listens_for(User, 'after_insert')
+def _count_user_insert(mapper, connection, target):
+    deltas = _version_deltas('users', target.id)
+    deltas[f'users:{target.role}'] = 1
+    bump_counters(connection, deltas)
+
+@event.listens_for(User, 'after_delete')
+def _count_user_delete(mapper, connection, target):
+    deltas = _version_deltas('users', target.id)
+    deltas[f'users:{target.role}'] = -1
+    bump_counters(connection, deltas)
+
+@event.listens_for(User, 'after_update')
+def _count_user_update(mapper, connection, target):
+    deltas = _version_deltas('users', target.id)
+    change = _changed(target, 'role')
+    if change and change[0] != change[1]:
+       old, new = change
+       deltas.update({f'users:{old}': -1, f'users:{new}': 1})
+    bump_counters(connection, deltas)
+
+@event.listens_for(Consultation, 'after_insert')
+def _count_consultation_insert(mapper, connection, target):
+    deltas = _version_deltas('consultations', target.patient_id, target.doctor_id)
+    deltas['consultations'] = 1
+    if target.status:
+       deltas[f'consultations:{target.status}'] = 1
+    bump_counters(connection, deltas)
+    key = daily_stat_key(target.doctor_id, target.scheduled_time, target.status)
+    if key:
+       bump_daily_stats(connection, {key: 1})
+
+@event.listens_for(Consultation, 'after_delete')
+def _count_consultation_delete(mapper, connection, target):
+    deltas = _version_deltas('consultations', target.patient_id, target.doctor_id)
+    deltas['consultations'] = -1
+    if target.status:
+       deltas[f'consultations:{target.status}'] = -1
+    bump_counters(connection, deltas)
+    key = daily_stat_key(target.doctor_id, target.scheduled_time, target.status)
+    if key:
+       bump_daily_stats(connection, {key: -1})
+
+@event.listens_for(Consultation, 'after_update')
+def _count_consultation_update(mapper, connection, target):
+    # Bump both old and new participants if the consultation was reassigned
+    participants = {target.patient_id, target.doctor_id}
+    for attr in ('patient_id', 'doctor_id'):
+       change = _changed(target, attr)
+       if change:
+          participants.add(change[0])
+    deltas = _version_deltas('consultations', *participants)
+    change = _changed(target, 'status')
+    if change and change[0] != change[1]:
+       old, new = change
+       if old:
+          deltas[f'consultations:{old}'] = -1
+       if new:
+          deltas[f'consultations:{new}'] = deltas.get(f'consultations:{new}', 0) + 1
+    bump_counters(connection, deltas)
+
+    # Move the row between rollup keys if its doctor, day or status changed
+    old_values = []
+    for attr in ('doctor_id', 'scheduled_time', 'status'):
+       change = _changed(target, attr)
+       old_values.append(change[0] if change else getattr(target, attr))
+    old_key = daily_stat_key(*old_values)
+    new_key = daily_stat_key(target.doctor_id, target.scheduled_time, target.status)
+    if old_key != new_key:
+       daily = {}
+       if old_key:
+          daily[old_key] = -1
+       if new_key:
+          daily[new_key] = 1
+       bump_daily_stats(connection, daily)
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute the dashboard counters and daily rollups from the source tables."""
+    reconcile_counters()
+    print("✅ Counters reconciled")
+
+# Schema migrations
+
+# Append-only list of (version, name, statements). db.create_all() only creates
+# missing tables, so anything added to an existing table (indexes, columns)
+# goes here. Statements are plain SQL, or a dict keyed by dialect name when
+# SQLite and Postgres need different DDL. A callable statement is a pre-check
+# that raises MigrationError. Never edit an applied entry.
+
+class MigrationError(Exception):
+    pass
+
+
+def check_unique_scheduled_slots():
+    # uq_consultation_doctor_slot can't be built over existing double bookings
+    duplicates = db.session.execute(text(
+       "SELECT doctor_id, scheduled_time, COUNT(*) FROM consultation WHERE status = 'scheduled' "
+       "GROUP BY doctor_id, scheduled_time HAVING COUNT(*) > 1 ORDER BY doctor_id, scheduled_time LIMIT 20"
+    )).all()
+    if duplicates:
+       listed = '; '.join(f'doctor {doctor_id} at {scheduled_time} ({count} rows)'
+                          for doctor_id, scheduled_time, count in duplicates)
+       raise MigrationError(
+          f"Scheduled consultations share a doctor and start time: {listed}. "
+          "Cancel or reschedule all but one of each, then run db-upgrade again"
+       )
+
+MIGRATIONS = [
+    (1, 'consultation composite indexes', [
+       'CREATE INDEX IF NOT EXISTS ix_consultation_doctor_status_time '
+       'ON consultation (doctor_id, status, scheduled_time)',
+       'CREATE INDEX IF NOT EXISTS ix_consultation_patient_status_time '
+       'ON consultation (patient_id, status, scheduled_time)',
+       'CREATE INDEX IF NOT EXISTS ix_consultation_created_at ON consultation (created_at)',
+    ]),
+    (2, 'seed stat counters', RECONCILE_COUNTERS_SQL),
+    (3, 'unique scheduled doctor slot', [
+       check_unique_scheduled_slots,
+       "CREATE UNIQUE INDEX IF NOT EXISTS uq_consultation_doctor_slot "
+       "ON consultation (doctor_id, scheduled_time) WHERE status = 'scheduled'",
+    ]),
+    # Patient search (see patient_search_query). SQLite gets an external-content FTS5
+    # trigram index kept current by triggers, so it changes in the same
+    # transaction as the user row; Postgres gets a pg_trgm GIN index.
+    (4, 'user search index', {
+       'sqlite': [
+          "CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5("
+          "first_name, last_name, email, content='user', content_rowid='id', "
+          "tokenize='trigram')",
+          'CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON "user" BEGIN '
+          'INSERT INTO user_search (rowid, first_name, last_name, email) '
+          'VALUES (new.id, new.first_name, new.last_name, new.email); END',
+          'CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON "user" BEGIN '
+          "INSERT INTO user_search (user_search, rowid, first_name, last_name, email) "
+          "VALUES ('delete', old.id, old.first_name, old.last_name, old.email); END",
+          'CREATE TRIGGER IF NOT EXISTS user_search_au '
+          'AFTER UPDATE OF first_name, last_name, email ON "user" BEGIN '
+          "INSERT INTO user_search (user_search, rowid, first_name, last_name, email) "
+          "VALUES ('delete', old.id, old.first_name, old.last_name, old.email); "
+          'INSERT INTO user_search (rowid, first_name, last_name, email) '
+          'VALUES (new.id, new.first_name, new.last_name, new.email); END',
+          "INSERT INTO user_search (user_search) VALUES ('rebuild')",
+       ],
+       'postgresql': [
+          'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+          'CREATE INDEX IF NOT EXISTS ix_user_search_trgm ON "user" USING gin '
+          "((lower(first_name || ' ' || last_name || ' ' || email)) gin_trgm_ops)",
+       ],
+    }),
+    (5, 'consultation status/time index for archival', [
+       'CREATE INDEX IF NOT EXISTS ix_consultation_status_time ON consultation (status, scheduled_time)',
+    ]),
+    (6, 'seed daily consultation stats', REBUILD_DAILY_STATS_SQL),
+    # Prefix half of patient search (see patient_search_query). Postgres needs
+    # text_pattern_ops for LIKE 'term%' to use the index under any collation.
+    (7, 'user prefix search indexes', {
+       'sqlite': [
+          f'CREATE INDEX IF NOT EXISTS ix_user_{column}_lower ON "user" (lower({column}))'
+          for column in ('first_name', 'last_name', 'email')
+       ],
+       'postgresql': [
+          f'CREATE INDEX IF NOT EXISTS ix_user_{column}_lower ON "user" (lower({column}) text_pattern_ops)'
+          for column in ('first_name', 'last_name', 'email')
+       ],
+    }),
+]
+
+def run_migrations():
+    db.create_all()
+    applied = {version for (version,) in db.session.query(SchemaMigration.version)}
+    dialect = db.engine.dialect.name
+    for version, name, statements in MIGRATIONS:
+       if version in applied:
+          continue
+       if isinstance(statements, dict):
+          statements = statements.get(dialect, [])
+       try:
+          for statement in statements:
+             if callable(statement):
+                statement()
+             else:
+                db.session.execute(text(statement))
+          db.session.add(SchemaMigration(version=version, name=name))
+          db.session.commit()
+       except Exception:
+          db.session.rollback()
+          raise
+       app.logger.info("Applied migration %s: %s", version, name)
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Create missing tables and apply pending schema migrations."""
+    try:
+       run_migrations()
+    except MigrationError as e:
+       raise click.ClickException(str(e))
+    print("✅ Database schema is up to date")
+
+# User cache
+
+class CachedUser:
+    # Read-only snapshot of a User row; safe to share across requests and sessions
+    __slots__ = ('id', 'email', 'role', 'first_name', 'last_name', 'created_at', 'is_active')
+
+    def __init__(self, user):
+       for name in self.__slots__:
+          setattr(self, name, getattr(user, name))
+
+    to_dict = User.to_dict
+
+
+class UserCache:
+    # Per-worker LRU with a TTL. Invalidation only reaches this process, so
+    # the TTL bounds how long other workers can serve a stale role/is_active.
+    def __init__(self, maxsize, ttl):
+       self.maxsize = maxsize
+       self.ttl = ttl
+       self.hits = 0
+       self.misses = 0
+       self._entries = OrderedDict()
+       self._lock = threading.Lock()
+
+    def get(self, user_id):
+       now = time.monotonic()
+       with self._lock:
+          entry = self._entries.get(user_id)
+          if entry is not None and entry[0] > now:
+             self._entries.move_to_end(user_id)
+             self.hits += 1
+             return entry[1]
+          if entry is not None:
+             del self._entries[user_id]
+          self.misses += 1
+          return None
+
+    def put(self, user):
+       with self._lock:
+          self._entries[user.id] = (time.monotonic() + self.ttl, user)
+          self._entries.move_to_end(user.id)
+          while len(self._entries) > self.maxsize:
+             self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+       with self._lock:
+          self._entries.pop(user_id, None)
+
+    def clear(self):
+       with self._lock:
+          self._entries.clear()
+
+    def stats(self):
+       with self._lock:
+          return {
+             'hits': self.hits,
+             'misses': self.misses,
+             'size': len(self._entries),
+             'maxsize': self.maxsize,
+             'ttl': self.ttl
+          }
+
+
+user_cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+def load_user(user_id):
+    user = user_cache.get(user_id)
+    if user is not None:
+       return user
+    row = db.session.get(User, user_id)
+    if row is None:
+       return None
+    user = CachedUser(row)
+    if app.config['USER_CACHE_SIZE'] > 0:
+       user_cache.put(user)
+    return user
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+    # Drop it again once committed, in case a concurrent request re-cached the old row
+    object_session(target).info.setdefault('invalidated_users', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('invalidated_users', ()):
+       user_cache.invalidate(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidated_users(session):
+    session.info.pop('invalidated_users', None)
+
+# Metrics
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'kalafo_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status'),
+    'kalafo_http_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'kalafo_sql_statements_total': ('counter', 'SQL statements executed by endpoint'),
+    'kalafo_sql_duration_seconds_total': ('counter', 'Time spent in SQL statements by endpoint'),
+    'kalafo_slow_queries_total': ('counter', 'Statements slower than SLOW_QUERY_MS'),
+    'kalafo_replica_fallbacks_total': ('counter', 'Read-replica health checks that failed over to the primary'),
+    'kalafo_user_cache_hits_total': ('counter', 'User cache hits'),
+    'kalafo_user_cache_misses_total': ('counter', 'User cache misses'),
+    'kalafo_login_throttled_total': ('counter', 'Login attempts rejected by the rate limiter, by bucket'),
+}
+
+
+class MetricsRegistry:
+    # Per-process counters and histograms. Each worker periodically writes a
+    # snapshot to METRICS_DIR/metrics-<pid>.json and /api/metrics sums all of
+    # them, so totals are correct across gunicorn workers.
+    def __init__(self):
+       self._lock = threading.Lock()
+       self._counters = {}
+       self._histograms = {}
+       self._last_flush = 0.0
+
+    def inc(self, name, labels, value=1):
+       key = (name, tuple(sorted(labels.items())))
+       with self._lock:
+          self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+       key = (name, tuple(sorted(labels.items())))
+       with self._lock:
+          entry = self._histograms.get(key)
+          if entry is None:
+             entry = self._histograms[key] = [[0] * len(LATENCY_BUCKETS), 0.0, 0]
+          for i, bound in enumerate(LATENCY_BUCKETS):
+             if value <= bound:
+                entry[0][i] += 1
+                break
+          entry[1] += value
+          entry[2] += 1
+
+    def reset(self):
+       with self._lock:
+          self._counters.clear()
+          self._histograms.clear()
+
+    def snapshot(self):
+       with self._lock:
+          counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+          histograms = [[name, list(labels), list(buckets), total, count]
+                        for (name, labels), (buckets, total, count) in self._histograms.items()]
+       cache = user_cache.stats()
+       counters.append(['kalafo_user_cache_hits_total', [], cache['hits']])
+       counters.append(['kalafo_user_cache_misses_total', [], cache['misses']])
+       return {'counters': counters, 'histograms': histograms}
+
+    def flush(self, force=False):
+       now = time.monotonic()
+       if not force and now - self._last_flush < app.config['METRICS_FLUSH_INTERVAL']:
+          return
+       self._last_flush = now
+       directory = app.config['METRICS_DIR']
+       os.makedirs(directory, exist_ok=True)
+       path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+       tmp_path = f'{path}.{threading.get_ident()}.tmp'
+       with open(tmp_path, 'w') as f:
+          json.dump(self.snapshot(), f)
+       os.replace(tmp_path, path)
+
+    def collect(self):
+       self.flush(force=True)
+       counters = {}
+       histograms = {}
+       directory = app.config['METRICS_DIR']
+       for filename in os.listdir(directory):
+          if not (filename.startswith('metrics-') and filename.endswith('.json')):
+             continue
+          try:
+             with open(os.path.join(directory, filename)) as f:
+                data = json.load(f)
+          except (OSError, ValueError):
+             continue
+          for name, labels, value in data['counters']:
+             key = (name, tuple(tuple(pair) for pair in labels))
+             counters[key] = counters.get(key, 0) + value
+          for name, labels, buckets, total, count in data['histograms']:
+             key = (name, tuple(tuple(pair) for pair in labels))
+             entry = histograms.setdefault(key, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+             entry[0] = [a + b for a, b in zip(entry[0], buckets)]
+             entry[1] += total
+             entry[2] += count
+       return counters, histograms
+
+    def render(self):
+       counters, histograms = self.collect()
+       by_name = {}
+       for (name, labels), value in sorted(counters.items()):
+          by_name.setdefault(name, []).append(_metric_line(name, labels, value))
+       for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+          lines = by_name.setdefault(name, [])
+          cumulative = 0
+          for bound, bucket in zip(LATENCY_BUCKETS, buckets):
+             cumulative += bucket
+             lines.append(_metric_line(f'{name}_bucket', labels + (('le', repr(bound)),), cumulative))
+          lines.append(_metric_line(f'{name}_bucket', labels + (('le', '+Inf'),), count))
+          lines.append(_metric_line(f'{name}_sum', labels, total))
+          lines.append(_metric_line(f'{name}_count', labels, count))
+       out = []
+       for name in sorted(by_name):
+          kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+          out.append(f'# HELP {name} {help_text}')
+          out.append(f'# TYPE {name} {kind}')
+          out.extend(by_name[name])
+       return '\n'.join(out) + '\n'
+
+
+def _metric_line(name, labels, value):
+    if labels:
+       rendered = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+       return f'{name}{{{rendered}}} {value}'
+    return f'{name} {value}'
+
+
+metrics = MetricsRegistry()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context rather than the pooled connection, so a
+    # failed statement (no after_cursor_execute) leaves nothing behind
+    if context is not None:
+       context.statement_started = time.perf_counter()
+
+# Statement totals of the current asgi.py native request, which has no Flask g
+sql_totals = contextvars.ContextVar('sql_totals', default=None)
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'statement_started', None)
+    if started is None:
+       return
+    elapsed = time.perf_counter() - started
+    if has_request_context() and 'sql_count' in g:
+       g.sql_count += 1
+       g.sql_time += elapsed
+    elif sql_totals.get() is not None:
+       totals = sql_totals.get()
+       totals[0] += 1
+       totals[1] += elapsed
+    threshold = app.config['SLOW_QUERY_MS']
+    if threshold is not None and elapsed * 1000 >= threshold:
+       metrics.inc('kalafo_slow_queries_total', {})
+       app.logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, ' '.join(statement.split()))
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+
+@app.after_request
+def _record_request(response):
+    if 'request_started' not in g:
+       return response
+    endpoint = request.endpoint or 'unmatched'
+    metrics.inc('kalafo_http_requests_total',
+                {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+    metrics.observe('kalafo_http_request_duration_seconds', {'endpoint': endpoint},
+                    time.perf_counter() - g.request_started)
+    if g.sql_count:
+       metrics.inc('kalafo_sql_statements_total', {'endpoint': endpoint}, g.sql_count)
+       metrics.inc('kalafo_sql_duration_seconds_total', {'endpoint': endpoint}, g.sql_time)
+    try:
+       metrics.flush()
+    except OSError:
+       app.logger.exception("Metrics flush error")
+    return response
+
+# Compression
+
+# Large JSON/text responses are compressed per Accept-Encoding: brotli when
+# the module is installed and the client prefers or ties it, else gzip.
+# Streamed responses (exports, events) and 304s pass through untouched.
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv', 'text/plain', 'application/x-ndjson')
+
+def _compress(data, encoding):
+    if encoding == 'br':
+       return brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+@app.after_request
+def _compress_response(response):
+    min_size = app.config['COMPRESS_MIN_SIZE']
+    if min_size and response.status_code == 304:
+       response.vary.add('Accept-Encoding')  # same Vary as the 200 it stands for
+       return response
+    if (not min_size or response.mimetype not in COMPRESSIBLE_TYPES
+          or response.direct_passthrough or response.is_streamed):
+       return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+          or response.content_length is None or response.content_length < min_size):
+       return response
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding is None:
+       return response
+    response.set_data(_compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# Login throttling
+
+# Token buckets per client IP and per account email, spent before the user
+# lookup and bcrypt so a credential-stuffing burst or a retry loop cannot use
+# up worker CPU. Buckets live in a small SQLite file shared by every worker on
+# the host (LOGIN_THROTTLE_DB). Each check is one BEGIN IMMEDIATE transaction,
+# so two workers cannot both spend the last token. If the store fails, logins
+# go through unthrottled rather than being locked out.
+
+class LoginThrottle:
+    PRUNE_INTERVAL = 60
+
+    def __init__(self):
+       self._local = threading.local()
+       self._last_prune = 0.0
+
+    def _connection(self):
+       # One connection per thread, reopened after a fork
+       local = self._local
+       if getattr(local, 'pid', None) != os.getpid():
+          path = app.config['LOGIN_THROTTLE_DB']
+          os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+          connection = sqlite3.connect(path, timeout=1, isolation_level=None)
+          connection.execute('PRAGMA journal_mode=WAL')
+          connection.execute('PRAGMA synchronous=OFF')  # buckets are disposable
+          connection.execute(
+             'CREATE TABLE IF NOT EXISTS login_bucket '
+             '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+          )
+          local.connection, local.pid = connection, os.getpid()
+       return local.connection
+
+    def take(self, buckets):
+       """Spend a token from each (scope, key, burst, per_minute) bucket.
+
+       Returns None if every bucket had one, else (scope, seconds until the
+       emptiest bucket refills) and spends nothing.
+       """
+       buckets = [bucket for bucket in buckets if bucket[2] > 0 and bucket[3] > 0]
+       if not buckets:
+          return None
+       now = time.time()
+       connection = self._connection()
+       connection.execute('BEGIN IMMEDIATE')
+       try:
+          levels = []
+          denied = None
+          for scope, key, burst, per_minute in buckets:
+             rate = per_minute / 60
+             row = connection.execute('SELECT tokens, updated FROM login_bucket WHERE key = ?', (key,)).fetchone()
+             tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+             if tokens < 1:
+                wait = (1 - tokens) / rate
+                if denied is None or wait > denied[1]:
+                   denied = (scope, wait)
+             levels.append((key, tokens - 1, now))
+          if denied is None:
+             connection.executemany(
+                'INSERT INTO login_bucket (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                levels
+             )
+          if now - self._last_prune > self.PRUNE_INTERVAL:
+             # Rows idle long enough to have refilled completely are dropped
+             self._last_prune = now
+             idle = max(burst / (per_minute / 60) for _, _, burst, per_minute in buckets)
+             connection.execute('DELETE FROM login_bucket WHERE updated < ?', (now - idle,))
+          connection.execute('COMMIT')
+       except BaseException:
+          if connection.in_transaction:
+             connection.execute('ROLLBACK')
+          raise
+       return denied
+
+login_throttle = LoginThrottle()
+
+def throttle_login(email):
+    # 429 response if this IP or account is out of login attempts, else None
+    try:
+       denied = login_throttle.take([
+          ('ip', f'ip:{request.remote_addr}',
+           app.config['LOGIN_IP_BURST'], app.config['LOGIN_IP_PER_MINUTE']),
+          ('account', f'account:{str(email).strip().lower()}',
+           app.config['LOGIN_ACCOUNT_BURST'], app.config['LOGIN_ACCOUNT_PER_MINUTE']),
+       ])
+    except sqlite3.Error:
+       app.logger.exception("Login throttle unavailable")
+       return None
+    if denied is None:
+       return None
+    scope, wait = denied
+    metrics.inc('kalafo_login_throttled_total', {'scope': scope})
+    response = jsonify({'error': 'Too many login attempts, please retry later'})
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response, 429
+
 # Helpers
 
 def get_current_user():
@@ -105,22 +1169,1332 @@ def get_current_user():
        user_id = None
     if user_id is None:
        return None
-    return User.query.get(user_id)
+    # Memoized for the app context, which /api/batch sub-requests share
+    user = g.get('current_user')
+    if user is None or user.id != user_id:
+       user = load_user(user_id)
+       g.current_user = user
+    return user
+
+def get_page_args(args=None):
+    # Keyset pagination: ?limit=N&after=<last id from the previous page>
+    if args is None:
+       args = request.args
+    try:
+       limit = int(args.get('limit', app.config['PAGE_SIZE_DEFAULT']))
+    except ValueError:
+       raise ValueError('Invalid limit')
+    if limit < 1:
+       raise ValueError('Invalid limit')
+    limit = min(limit, app.config['PAGE_SIZE_MAX'])
+
+    after = args.get('after')
+    if after in (None, ''):
+       return limit, None
+    try:
+       return limit, int(after)
+    except ValueError:
+       raise ValueError('Invalid cursor')
+
+def consultation_listing():
+    # Consultations joined with both participants' names in the same SELECT, so
+    # listing N rows never lazy-loads Consultation.patient / Consultation.doctor.
+    # Filter with Consultation.<column> (not filter_by, which targets the last join).
+    # A select() rather than a Query, so asgi.py can run it on an async session.
+    patient = aliased(User)
+    doctor = aliased(User)
+    return select(
+       Consultation,
+       patient.first_name, patient.last_name,
+       doctor.first_name, doctor.last_name
+    ).outerjoin(patient, Consultation.patient_id == patient.id) \
+       .outerjoin(doctor, Consultation.doctor_id == doctor.id)
+
+def serialize_consultations(rows):
+    data = []
+    for c, patient_first, patient_last, doctor_first, doctor_last in rows:
+       patient_name = f"{patient_first} {patient_last}" if patient_first is not None else None
+       doctor_name = f"Dr. {doctor_first} {doctor_last}" if doctor_first is not None else None
+       data.append(consultation_dict(c, patient_name, doctor_name))
+    return data
 
-def role_required(*allowed_roles):
+# Patient search over name and email. Candidates come from indexes only, at
+# most SEARCH_MAX_MATCHES per source, so broad terms stay fast and the user
+# refines the term instead: prefix matches from the lower() expression indexes
+# of migration 7, plus, for SEARCH_MIN_CHARS or more, substring matches from
+# the user search index of migration 4 (trigrams cannot serve shorter terms).
+# Prefix matches are fetched separately because they rank first, so a broad
+# substring window can't crowd them out. Then the earliest match and the
+# shortest name/email (SQLite) or trigram similarity (Postgres) rank the rest.
+SEARCH_MIN_CHARS = 3
+SEARCH_COLUMNS = ('first_name', 'last_name', 'email')
+
+_SEARCH_PREFIX_MATCH = (
+    "lower(first_name) LIKE :prefix ESCAPE '\\' "
+    "OR lower(last_name) LIKE :prefix ESCAPE '\\' "
+    "OR lower(email) LIKE :prefix ESCAPE '\\'"
+)
+
+_SEARCH_DOCUMENT = "lower(first_name || ' ' || last_name || ' ' || email)"
+
+# SQLite only uses an expression index for a range, not for LIKE
+_PREFIX_CANDIDATE = {
+    'sqlite': "lower({column}) >= :lower_bound AND lower({column}) < :upper_bound",
+    'postgresql': "lower({column}) LIKE :prefix ESCAPE '\\'",
+}
+
+_SUBSTRING_CANDIDATES = {
+    # The FTS table indexes every user, so drop non-patients before the window
+    'sqlite': 'SELECT id FROM (SELECT user_search.rowid AS id FROM user_search '
+              'JOIN "user" u ON u.id = user_search.rowid '
+              "WHERE user_search MATCH :match AND u.role = 'patient' LIMIT :window)",
+    'postgresql': 'SELECT id FROM (SELECT id FROM "user" '
+                  f"WHERE role = 'patient' AND {_SEARCH_DOCUMENT} LIKE :pattern ESCAPE '\\' LIMIT :window)",
+}
+
+_SEARCH_RANK = {
+    'sqlite': f'instr({_SEARCH_DOCUMENT}, :term), length(first_name || last_name || email)',
+    'postgresql': f'similarity({_SEARCH_DOCUMENT}, :term) DESC',
+}
+
+def _patient_search_sql(dialect, substring):
+    candidates = [
+       'SELECT id FROM (SELECT id FROM "user" '
+       f"WHERE role = 'patient' AND {_PREFIX_CANDIDATE[dialect].format(column=column)} LIMIT :window)"
+       for column in SEARCH_COLUMNS
+    ]
+    if substring:
+       candidates.append(_SUBSTRING_CANDIDATES[dialect])
+    return (
+       f"WITH c AS ({' UNION '.join(candidates)}) "
+       'SELECT u.id FROM c JOIN "user" u ON u.id = c.id '
+       "WHERE u.role = 'patient' "
+       f'ORDER BY CASE WHEN {_SEARCH_PREFIX_MATCH} THEN 0 ELSE 1 END, {_SEARCH_RANK[dialect]}, u.id '
+       'LIMIT :limit OFFSET :offset'
+    )
+
+PATIENT_SEARCH_SQL = {dialect: _patient_search_sql(dialect, True) for dialect in _SEARCH_RANK}
+PATIENT_PREFIX_SEARCH_SQL = {dialect: _patient_search_sql(dialect, False) for dialect in _SEARCH_RANK}
+
+# Other databases have no search indexes and scan for prefix matches
+PATIENT_PREFIX_SQL = (
+    'SELECT id FROM "user" '
+    f"WHERE role = 'patient' AND ({_SEARCH_PREFIX_MATCH}) "
+    'ORDER BY id LIMIT :limit OFFSET :offset'
+)
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def patient_search_query(term, limit, offset, dialect):
+    term = term.strip().lower()
+    params = {
+       'term': term,
+       'prefix': _like_escape(term) + '%',
+       'pattern': '%' + _like_escape(term) + '%',
+       # FTS5 phrase query: the trigram tokenizer matches it as a substring
+       'match': '"' + term.replace('"', '""') + '"',
+       # [lower_bound, upper_bound) holds exactly the strings starting with term
+       'lower_bound': term,
+       'upper_bound': term[:-1] + chr(ord(term[-1]) + 1) if term else '',
+       'window': app.config['SEARCH_MAX_MATCHES'],
+       'limit': limit,
+       'offset': offset,
+    }
+    if dialect not in PATIENT_SEARCH_SQL:
+       statement = PATIENT_PREFIX_SQL
+    elif len(term) >= SEARCH_MIN_CHARS:
+       statement = PATIENT_SEARCH_SQL[dialect]
+    else:
+       statement = PATIENT_PREFIX_SEARCH_SQL[dialect]
+    return text(statement), params
+
+class TokenUser:
+    # Current user in AUTH_TRUST_TOKEN_CLAIMS mode: id and role come from the
+    # verified token, any other attribute loads the user on first access.
+    __slots__ = ('id', 'role', '_user')
+
+    def __init__(self, user_id, role):
+       self.id = user_id
+       self.role = role
+       self._user = None
+
+    def __getattr__(self, name):
+       if self._user is None:
+          self._user = load_user(self.id)
+          if self._user is None:
+             raise LookupError(f'User {self.id} not found')
+       return getattr(self._user, name)
+
+def role_required(*allowed_roles, locations=None, user_row=False):
+    # user_row=True loads and checks the user even under AUTH_TRUST_TOKEN_CLAIMS,
+    # for views that read more than its id and role and for every write route,
+    # so a deactivated account or a changed role stops writes at once
     def decorator(fn):
        @wraps(fn)
-       @jwt_required()
+       @jwt_required(locations=locations)
        def wrapper(*args, **kwargs):
+          role = get_jwt().get('role') if app.config['AUTH_TRUST_TOKEN_CLAIMS'] and not user_row else None
+          if role:
+             # Authorize from the claims alone; handlers that only need the id
+             # and role never touch the database for the user
+             if role not in allowed_roles:
+                return jsonify({'error': 'Access denied'}), 403
+             try:
+                user_id = int(get_jwt_identity())
+             except (TypeError, ValueError):
+                return jsonify({'error': 'User not found'}), 404
+             return fn(TokenUser(user_id, role), *args, **kwargs)
           user = get_current_user()
           if not user:
              return jsonify({'error': 'User not found'}), 404
           if user.role not in allowed_roles:
              return jsonify({'error': 'Access denied'}), 403
+          if not user.is_active:
+             return jsonify({'error': 'Account is deactivated'}), 401
           return fn(user, *args, **kwargs)
+       # asgi.py serves some of these views natively and applies the same checks
+       wrapper.allowed_roles = allowed_roles
+       wrapper.user_row = user_row
+       wrapper.token_locations = locations
        return wrapper
     return decorator
 
+_replica_health = {'checked': None, 'healthy': False}
+_replica_lock = threading.Lock()
+
+def mark_replica_down():
+    with _replica_lock:
+       _replica_health.update(checked=time.monotonic(), healthy=False)
+    metrics.inc('kalafo_replica_fallbacks_total', {})
+    app.logger.warning("Read replica unavailable, serving reads from the primary")
+
+def replica_available():
+    if 'replica' not in db.engines:
+       return False
+    with _replica_lock:
+       checked, healthy = _replica_health['checked'], _replica_health['healthy']
+       due = checked is None or time.monotonic() - checked >= app.config['REPLICA_CHECK_INTERVAL']
+       if due:
+          # Claim this check; other threads keep the last answer meanwhile
+          _replica_health['checked'] = time.monotonic()
+    if not due:
+       return healthy
+    try:
+       with db.engines['replica'].connect() as conn:
+          conn.execute(text('SELECT 1'))
+    except Exception:
+       mark_replica_down()
+       return False
+    with _replica_lock:
+       _replica_health.update(checked=time.monotonic(), healthy=True)
+    return True
+
+@event.listens_for(Engine, 'handle_error')
+def _note_replica_error(context):
+    # Routes turn exceptions into 500s themselves, so read_replica learns of a
+    # failed replica query from this flag rather than from the exception. Any
+    # DBAPI error counts: a replica behind a migration raises "no such table"
+    # (OperationalError) on SQLite but ProgrammingError on Postgres.
+    if (has_request_context() and g.get('read_replica')
+          and isinstance(context.sqlalchemy_exception, DBAPIError)
+          and context.engine is db.engines.get('replica')):
+       g.replica_failed = True
+
+def read_replica(fn):
+    # Route reads in `fn` to DATABASE_READ_URL when configured and reachable.
+    # Apply inside role_required so the user lookup stays on the primary.
+    # A replica that fails between health checks is marked down and the
+    # route runs again on the primary, whether the view caught the error or
+    # it escaped from a decorator below (conditional_get's counters read).
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+       g.read_replica = replica_available()
+       g.replica_failed = False
+       try:
+          try:
+             response = fn(*args, **kwargs)
+          except DBAPIError:
+             if not g.read_replica:
+                raise
+             g.replica_failed = True
+          if g.replica_failed:
+             mark_replica_down()
+             db.session.rollback()
+             g.read_replica = False
+             response = fn(*args, **kwargs)
+          return response
+       finally:
+          g.read_replica = False
+    wrapper.uses_replica = True
+    return wrapper
+
+def conditional_get(*version_keys):
+    # Weak ETag from the change versions a response depends on. Keys may use
+    # '{user_id}' for the current user. A matching If-None-Match returns 304
+    # after a single counters read, before the view runs any queries.
+    def decorator(fn):
+       @wraps(fn)
+       def wrapper(current_user, *args, **kwargs):
+          keys = [key.format(user_id=current_user.id) for key in version_keys]
+          versions = read_counters(*keys)
+          etag = view_etag(request.endpoint, current_user.id, request.query_string,
+                           [versions[key] for key in keys])
+          if request.if_none_match.contains_weak(etag):
+             response = app.response_class(status=304)
+          else:
+             response = make_response(fn(current_user, *args, **kwargs))
+             if response.status_code != 200:
+                return response
+          response.set_etag(etag, weak=True)
+          response.headers['Cache-Control'] = 'private, no-cache'
+          return response
+       wrapper.version_keys = version_keys
+       return wrapper
+    return decorator
+
+def view_etag(endpoint, user_id, query_string, versions):
+    # Shared with asgi.py, so an ETag from either path revalidates on the other
+    fingerprint = repr((endpoint, user_id, query_string, versions))
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+# Read views
+
+# The dashboards and listings that asgi.py also serves natively. Each view is
+# a generator: it yields the statements it needs (a statement, or a
+# (statement, params) pair), is sent the rows of each and returns
+# (body, status). run_read_view() runs them on db.session and asgi.py runs
+# them on an async session, so both paths issue the same queries and build
+# the same bodies. asgi.py takes the roles, @read_replica and the ETag keys
+# from the Flask routes' decorators.
+
+def run_read_view(view, current_user):
+    plan = view(current_user, request.args, db.session.get_bind().dialect.name)
+    rows = None
+    try:
+       while True:
+          step = plan.send(rows)
+          statement, params = step if isinstance(step, tuple) else (step, None)
+          rows = db.session.execute(statement, params).all()
+    except StopIteration as done:
+       body, status = done.value
+    return jsonify(body), status
+
+ADMIN_DASHBOARD_COUNTERS = ('users:doctor', 'users:patient', 'consultations', 'consultations:scheduled')
+
+def admin_dashboard_view(current_user, args, dialect):
+    counters = counter_values((yield counters_query(*ADMIN_DASHBOARD_COUNTERS)), ADMIN_DASHBOARD_COUNTERS)
+    recent = yield consultation_listing().order_by(Consultation.created_at.desc()).limit(10)
+    return {
+       'stats': {
+          'total_doctors': counters['users:doctor'],
+          'total_patients': counters['users:patient'],
+          'total_consultations': counters['consultations'],
+          'active_consultations': counters['consultations:scheduled']
+       },
+       'recent_consultations': serialize_consultations(recent)
+    }, 200
+
+def patient_dashboard_view(current_user, args, dialect):
+    upcoming = yield consultation_listing() \
+       .where(Consultation.patient_id == current_user.id, Consultation.status == 'scheduled') \
+       .order_by(Consultation.scheduled_time.asc()).limit(app.config['DASHBOARD_LIST_LIMIT'])
+    # Older visits are paged through /api/consultations/history
+    past = yield consultation_listing() \
+       .where(Consultation.patient_id == current_user.id, Consultation.status == 'completed') \
+       .order_by(Consultation.scheduled_time.desc()).limit(app.config['DASHBOARD_LIST_LIMIT'])
+    return {
+       'upcoming_consultations': serialize_consultations(upcoming),
+       'past_consultations': serialize_consultations(past),
+       'patient_info': current_user.to_dict()
+    }, 200
+
+def doctor_dashboard_view(current_user, args, dialect):
+    upcoming = yield consultation_listing() \
+       .where(Consultation.doctor_id == current_user.id, Consultation.status == 'scheduled') \
+       .order_by(Consultation.scheduled_time.asc()).limit(app.config['DASHBOARD_LIST_LIMIT'])
+    recent = yield consultation_listing() \
+       .where(Consultation.doctor_id == current_user.id, Consultation.status == 'completed') \
+       .order_by(Consultation.scheduled_time.desc()).limit(10)
+    return {
+       'upcoming_consultations': serialize_consultations(upcoming),
+       'recent_consultations': serialize_consultations(recent),
+       'doctor_info': current_user.to_dict()
+    }, 200
+
+def users_view(current_user, args, dialect):
+    users = yield select(User)
+    return {'users': [u.to_dict() for (u,) in users]}, 200
+
+def patients_view(current_user, args, dialect):
+    try:
+       limit, after = get_page_args(args)
+    except ValueError as e:
+       return {'error': str(e)}, 400
+
+    query = select(User).where(User.role == 'patient')
+
+    term = args.get('q', '').strip()
+    if term:
+       # Ranked search pages by ?offset= rather than the id cursor
+       try:
+          offset = int(args.get('offset', 0))
+       except ValueError:
+          return {'error': 'Invalid offset'}, 400
+       if offset < 0:
+          return {'error': 'Invalid offset'}, 400
+       matches = yield patient_search_query(term, limit + 1, offset, dialect)
+       ids = [user_id for (user_id,) in matches]
+       has_more = len(ids) > limit
+       ids = ids[:limit]
+       rank = {user_id: i for i, user_id in enumerate(ids)}
+       rows = (yield query.where(User.id.in_(ids))) if ids else []
+       patients = sorted((p for (p,) in rows), key=lambda p: rank[p.id])
+    else:
+       query = query.order_by(User.id.asc())
+       if after is not None:
+          query = query.where(User.id > after)
+       patients = [p for (p,) in (yield query.limit(limit + 1))]
+       has_more = len(patients) > limit
+       patients = patients[:limit]
+
+    # One grouped query per page instead of two lookups per patient
+    stats = {}
+    if patients:
+       rows = yield patient_stats_query([p.id for p in patients])
+       stats = {patient_id: (count, last) for patient_id, count, last in rows}
+    data = []
+    for p in patients:
+       info = p.to_dict()
+       info['consultation_count'], last = stats.get(p.id, (0, None))
+       info['last_consultation'] = last.isoformat() if last else None
+       data.append(info)
+
+    if term:
+       next_offset = offset + len(patients) if has_more else None
+       return {'patients': data, 'next_offset': next_offset}, 200
+
+    total_count = counter_values((yield counters_query('users:patient')), ('users:patient',))['users:patient']
+    next_cursor = patients[-1].id if has_more else None
+    return {'patients': data, 'total_count': total_count, 'next_cursor': next_cursor}, 200
+
+def doctors_view(current_user, args, dialect):
+    doctors = yield select(User).where(User.role == 'doctor', User.is_active == true()) \
+       .order_by(User.last_name, User.first_name)
+    return {'doctors': [{
+       'id': d.id,
+       'first_name': d.first_name,
+       'last_name': d.last_name
+    } for (d,) in doctors]}, 200
+
+# Exports
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def get_date_range():
+    # Optional ?from=&to= ISO dates/datetimes; 'to' is exclusive
+    bounds = []
+    for arg in ('from', 'to'):
+       value = request.args.get(arg)
+       if not value:
+          bounds.append(None)
+          continue
+       try:
+          bounds.append(datetime.fromisoformat(value))
+       except ValueError:
+          raise ValueError(f"Invalid '{arg}' date")
+    return bounds
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def stream_export(statement, fmt, filename):
+    # Rows are fetched and written one chunk at a time (a server-side cursor
+    # where the driver supports it), so memory stays flat whatever the table
+    # size. If the client disconnects, the server closes the generator and the
+    # finally block releases the cursor.
+    chunk_size = app.config['EXPORT_CHUNK_SIZE']
+
+    def generate():
+       result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+       try:
+          columns = list(result.keys())
+          buffer = io.StringIO()
+          writer = csv.writer(buffer)
+          if fmt == 'csv':
+             writer.writerow(columns)
+          for rows in result.partitions():
+             for row in rows:
+                values = [_export_value(value) for value in row]
+                if fmt == 'csv':
+                   writer.writerow(values)
+                else:
+                   buffer.write(json.dumps(dict(zip(columns, values))))
+                   buffer.write('\n')
+             yield buffer.getvalue()
+             buffer.seek(0)
+             buffer.truncate()
+          if fmt == 'csv' and buffer.tell():
+             yield buffer.getvalue()
+       finally:
+          result.close()
+
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{fmt}'
+    return response
+
+def export_args():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+       raise ValueError('Invalid format, expected ndjson or csv')
+    start, end = get_date_range()
+    return fmt, start, end
+
+# Analytics
+
+# Utilization per day and per doctor, read from consultation_daily_stat (see
+# Counters). A consultation still 'scheduled' on a past day counts as a no-show;
+# rates are over consultations whose day has passed or that were resolved.
+
+ANALYTICS_OUTCOMES = ('completed', 'cancelled', 'no_show', 'scheduled')
+
+def analytics_range(today):
+    # ?from=&to= dates ('to' exclusive), the last 30 days by default
+    start, end = get_date_range()
+    end = end.date() if end else today + timedelta(days=1)
+    start = start.date() if start else end - timedelta(days=30)
+    if start >= end:
+       raise ValueError("'from' must be before 'to'")
+    if (end - start).days > app.config['ANALYTICS_MAX_DAYS']:
+       raise ValueError(f"Date range is limited to {app.config['ANALYTICS_MAX_DAYS']} days")
+    return start, end
+
+def analytics_summary(counts):
+    summary = {outcome: counts.get(outcome, 0) for outcome in ANALYTICS_OUTCOMES}
+    summary['total'] = sum(summary.values())
+    resolved = summary['completed'] + summary['cancelled'] + summary['no_show']
+    for outcome, rate in (('completed', 'completion_rate'), ('cancelled', 'cancellation_rate'),
+                          ('no_show', 'no_show_rate')):
+       summary[rate] = round(summary[outcome] / resolved, 4) if resolved else None
+    return summary
+
+def consultation_analytics(start, end, today, doctor_id=None):
+    stat = ConsultationDailyStat
+    outcome = case(
+       (and_(stat.status == 'scheduled', stat.day < today), literal('no_show')),
+       else_=stat.status
+    ).label('outcome')
+    conditions = [stat.day >= start, stat.day < end]
+    if doctor_id is not None:
+       conditions.append(stat.doctor_id == doctor_id)
+
+    days = {}
+    by_day = select(stat.day, outcome, func.sum(stat.count)).where(*conditions) \
+       .group_by(stat.day, outcome).order_by(stat.day)
+    for day, name, count in db.session.execute(by_day):
+       days.setdefault(day, {})[name] = count
+
+    doctors = {}
+    by_doctor = select(stat.doctor_id, outcome, func.sum(stat.count)).where(*conditions) \
+       .group_by(stat.doctor_id, outcome)
+    for doctor, name, count in db.session.execute(by_doctor):
+       doctors.setdefault(doctor, {})[name] = count
+    names = {}
+    if doctors:
+       names = {user_id: f"Dr. {first} {last}" for user_id, first, last in db.session.execute(
+          select(User.id, User.first_name, User.last_name).where(User.id.in_(doctors)))}
+
+    totals = {}
+    for counts in doctors.values():
+       for name, count in counts.items():
+          totals[name] = totals.get(name, 0) + count
+    return {
+       'from': start,
+       'to': end,
+       'totals': analytics_summary(totals),
+       'days': [{'day': day, **analytics_summary(counts)} for day, counts in days.items()],
+       'doctors': sorted(
+          ({'doctor_id': doctor, 'doctor_name': names.get(doctor), **analytics_summary(counts)}
+           for doctor, counts in doctors.items()),
+          key=lambda row: row['doctor_id']
+       )
+    }
+
+# Booking
+
+# Consultations last CONSULTATION_SLOT_MINUTES and new ones start on slot
+# boundaries, so two new bookings overlap exactly when they share (doctor_id,
+# scheduled_time). The partial unique index uq_consultation_doctor_slot
+# enforces that in the database: the losing insert/update of a concurrent pair
+# fails with IntegrityError (after waiting on the winner's row lock on
+# Postgres) instead of racing a check-then-insert. Rows that don't start on a
+# boundary (legacy data, or a changed slot length) can't race, so a range
+# check against them before the write is enough. Cancelled and completed rows
+# free the slot.
+
+class BookingError(Exception):
+    def __init__(self, message, status=400):
+       super().__init__(message)
+       self.status = status
+
+
+def parse_slot(value):
+    if not value:
+       raise BookingError('scheduled_time is required')
+    try:
+       slot = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+       raise BookingError('Invalid scheduled_time')
+    if slot.tzinfo is not None:
+       slot = slot.astimezone(timezone.utc).replace(tzinfo=None)
+    minutes = app.config['CONSULTATION_SLOT_MINUTES']
+    if slot.second or slot.microsecond or (slot.hour * 60 + slot.minute) % minutes:
+       raise BookingError(f'scheduled_time must start on a {minutes}-minute slot')
+    if slot <= datetime.utcnow():
+       raise BookingError('scheduled_time must be in the future')
+    return slot
+
+def slot_start(moment):
+    # Start of the slot containing `moment`
+    length = timedelta(minutes=app.config['CONSULTATION_SLOT_MINUTES'])
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + (moment - midnight) // length * length
+
+def covered_slots(doctor_id, start):
+    # Slots a consultation starting at `start` overlaps: its own, and the next
+    # one too when it doesn't start on a boundary
+    first = slot_start(start)
+    slots = {(doctor_id, first)}
+    if first != start:
+       slots.add((doctor_id, first + timedelta(minutes=app.config['CONSULTATION_SLOT_MINUTES'])))
+    return slots
+
+def _check_slot_free(doctor_id, slot, consultation_id=None):
+    length = timedelta(minutes=app.config['CONSULTATION_SLOT_MINUTES'])
+    query = Consultation.query.filter(
+       Consultation.doctor_id == doctor_id,
+       Consultation.status == 'scheduled',
+       Consultation.scheduled_time > slot - length,
+       Consultation.scheduled_time < slot + length
+    )
+    if consultation_id is not None:
+       query = query.filter(Consultation.id != consultation_id)
+    if db.session.query(query.exists()).scalar():
+       raise BookingError('Doctor is already booked for this slot', 409)
+
+def _require_user(user_id, role):
+    try:
+       user = db.session.get(User, int(user_id))
+    except (TypeError, ValueError):
+       user = None
+    if user is None or user.role != role or not user.is_active:
+       raise BookingError(f'Unknown {role}', 404)
+    return user
+
+def _is_slot_conflict(error):
+    # Postgres names the index; SQLite lists the columns it covers
+    message = str(error.orig)
+    return ('uq_consultation_doctor_slot' in message
+            or 'consultation.doctor_id, consultation.scheduled_time' in message)
+
+def _commit_booking():
+    try:
+       db.session.commit()
+    except IntegrityError as e:
+       db.session.rollback()
+       if not _is_slot_conflict(e):
+          raise
+       raise BookingError('Doctor is already booked for this slot', 409)
+
+def book_consultation(current_user, data):
+    if current_user.role == 'patient':
+       patient_id = current_user.id
+    else:
+       patient_id = _require_user(data.get('patient_id'), 'patient').id
+    if current_user.role == 'doctor':
+       doctor_id = current_user.id
+    else:
+       doctor_id = _require_user(data.get('doctor_id'), 'doctor').id
+    scheduled_time = parse_slot(data.get('scheduled_time'))
+    _check_slot_free(doctor_id, scheduled_time)
+    consultation = Consultation(
+       patient_id=patient_id,
+       doctor_id=doctor_id,
+       scheduled_time=scheduled_time,
+       status='scheduled',
+       notes=data.get('notes')
+    )
+    db.session.add(consultation)
+    _commit_booking()
+    return consultation
+
+def get_booking_for_update(current_user, consultation_id):
+    # Row lock (FOR UPDATE on Postgres) so concurrent edits of one booking serialize
+    consultation = Consultation.query.filter_by(id=consultation_id).with_for_update().first()
+    if consultation is None:
+       raise BookingError('Consultation not found', 404)
+    if current_user.role != 'admin' and current_user.id not in (consultation.patient_id, consultation.doctor_id):
+       raise BookingError('Access denied', 403)
+    if consultation.status != 'scheduled':
+       raise BookingError(f'Consultation is {consultation.status}', 409)
+    return consultation
+
+def reschedule_consultation(current_user, consultation_id, data):
+    consultation = get_booking_for_update(current_user, consultation_id)
+    scheduled_time = parse_slot(data.get('scheduled_time'))
+    _check_slot_free(consultation.doctor_id, scheduled_time, consultation.id)
+    consultation.scheduled_time = scheduled_time
+    _commit_booking()
+    return consultation
+
+def cancel_consultation(current_user, consultation_id):
+    consultation = get_booking_for_update(current_user, consultation_id)
+    consultation.status = 'cancelled'
+    db.session.commit()
+    return consultation
+
+def booked_slots(doctor_ids, start, end):
+    # (doctor_id, slot) pairs taken between start and end, counting both slots
+    # an off-boundary booking overlaps. Index range read on uq_consultation_doctor_slot
+    length = timedelta(minutes=app.config['CONSULTATION_SLOT_MINUTES'])
+    slots = set()
+    doctor_ids = list(doctor_ids)
+    for i in range(0, len(doctor_ids), 500):
+       for doctor_id, scheduled_time in db.session.query(Consultation.doctor_id, Consultation.scheduled_time).filter(
+          Consultation.doctor_id.in_(doctor_ids[i:i + 500]),
+          Consultation.status == 'scheduled',
+          Consultation.scheduled_time > start - length,
+          Consultation.scheduled_time <= end
+       ):
+          slots.update(slot for slot in covered_slots(doctor_id, scheduled_time) if start <= slot[1] <= end)
+    return slots
+
+def consultation_response(consultation):
+    rows = db.session.execute(consultation_listing().where(Consultation.id == consultation.id)).all()
+    return serialize_consultations(rows)[0]
+
+# Live events
+
+# Consultation changes are written to consultation_event by the mapper events
+# below, in the same transaction as the change. The table is the pub/sub
+# channel between gunicorn workers: each worker runs one poller thread that
+# reads new rows and fans them out to its own /api/events streams (the doctor,
+# the patient and every admin). The poller only runs while the worker has
+# subscribers, and prunes rows older than EVENTS_RETENTION, which also bounds
+# how far back a reconnecting client (Last-Event-ID) can replay. Like the
+# counters, writes that bypass the ORM unit of work (bulk imports) publish
+# nothing. asgi.py subscribes its event-loop streams to the same hub, so there
+# an open stream holds no thread.
+
+def _publish_consultation_event(connection, target, kind, previous_status=None):
+    connection.execute(insert(ConsultationEvent), {
+       'consultation_id': target.id,
+       'patient_id': target.patient_id,
+       'doctor_id': target.doctor_id,
+       'kind': kind,
+       'status': target.status,
+       'previous_status': previous_status,
+       'scheduled_time': target.scheduled_time,
+    })
+
+@event.listens_for(Consultation, 'after_insert')
+def _publish_consultation_insert(mapper, connection, target):
+    _publish_consultation_event(connection, target, 'created')
+
+@event.listens_for(Consultation, 'after_update')
+def _publish_consultation_update(mapper, connection, target):
+    status = _changed(target, 'status')
+    if status and status[0] != status[1]:
+       _publish_consultation_event(connection, target, 'status', status[0])
+    elif _changed(target, 'scheduled_time'):
+       _publish_consultation_event(connection, target, 'rescheduled')
+
+def event_audience(user):
+    keys = [f'user:{user.id}']
+    if user.role == 'admin':
+       keys.append('role:admin')
+    return keys
+
+class EventSubscriber:
+    def __init__(self, keys):
+       self.keys = keys
+       self.queue = queue.Queue(maxsize=app.config['EVENTS_QUEUE_SIZE'])
+       self.overflowed = False
+
+    def put(self, event):
+       # A stream that can't keep up is closed; the client reconnects with
+       # Last-Event-ID and replays what it missed from the table
+       try:
+          self.queue.put_nowait(event)
+       except queue.Full:
+          self.overflowed = True
+
+class EventHub:
+    # Postgres can commit sequence values out of order, so each poll re-reads
+    # the last LOOKBACK ids and skips the ones already delivered.
+    LOOKBACK = 100
+    PRUNE_INTERVAL = 60
+
+    def __init__(self):
+       self._lock = threading.Lock()
+       self._subscribers = {}
+       self._thread = None
+       self._pid = None
+
+    def subscribe(self, subscriber):
+       with self._lock:
+          for key in subscriber.keys:
+             self._subscribers.setdefault(key, set()).add(subscriber)
+          if self._thread is None or self._pid != os.getpid():
+             self._pid = os.getpid()
+             self._thread = threading.Thread(target=self._run, name='kalafo-events', daemon=True)
+             self._thread.start()
+       return subscriber
+
+    def unsubscribe(self, subscriber):
+       with self._lock:
+          for key in subscriber.keys:
+             subscribers = self._subscribers.get(key)
+             if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                   del self._subscribers[key]
+
+    def publish(self, event):
+       keys = ('role:admin', f"user:{event['patient_id']}", f"user:{event['doctor_id']}")
+       with self._lock:
+          targets = set().union(*(self._subscribers.get(key, ()) for key in keys))
+       for subscriber in targets:
+          subscriber.put(event)
+
+    def _run(self):
+       with app.app_context():
+          # Start from the current tail; a new stream doesn't get history
+          with db.engine.connect() as conn:
+             recent = conn.execute(
+                select(ConsultationEvent.id).order_by(ConsultationEvent.id.desc()).limit(self.LOOKBACK)
+             ).scalars().all()
+          last_id = recent[0] if recent else 0
+          delivered = OrderedDict.fromkeys(reversed(recent), True)
+          last_prune = 0.0
+          while True:
+             time.sleep(app.config['EVENTS_POLL_INTERVAL'])
+             with self._lock:
+                if not self._subscribers:
+                   self._thread = None
+                   return
+             try:
+                with db.engine.connect() as conn:
+                   rows = conn.execute(
+                      select(ConsultationEvent)
+                      .where(ConsultationEvent.id > last_id - self.LOOKBACK)
+                      .order_by(ConsultationEvent.id)
+                   ).all()
+                for row in rows:
+                   if row.id in delivered:
+                      continue
+                   delivered[row.id] = True
+                   if len(delivered) > self.LOOKBACK * 10:
+                      delivered.popitem(last=False)
+                   last_id = max(last_id, row.id)
+                   self.publish(ConsultationEvent.to_dict(row))
+                if time.monotonic() - last_prune > self.PRUNE_INTERVAL:
+                   last_prune = time.monotonic()
+                   prune_events()
+             except Exception:
+                app.logger.exception("Event poller error")
+
+event_hub = EventHub()
+
+def prune_events():
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['EVENTS_RETENTION'])
+    with db.engine.begin() as conn:
+       conn.execute(ConsultationEvent.__table__.delete().where(ConsultationEvent.created_at < cutoff))
+
+def replay_query(user, after_id):
+    query = select(ConsultationEvent).where(ConsultationEvent.id > after_id)
+    if user.role != 'admin':
+       query = query.where((ConsultationEvent.patient_id == user.id) | (ConsultationEvent.doctor_id == user.id))
+    return query.order_by(ConsultationEvent.id).limit(app.config['EVENTS_REPLAY_LIMIT'])
+
+def replay_events(user, after_id):
+    return [e.to_dict() for e in db.session.scalars(replay_query(user, after_id))]
+
+def sse_message(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {app.json.dumps(event)}\n\n"
+
+def stream_events(subscriber, backlog):
+    # Deliberately not stream_with_context: the request context (and its
+    # database session) is released as soon as the response starts, so an
+    # idle stream holds no connection. Heartbeats keep proxies from timing the
+    # stream out and surface disconnects within EVENTS_HEARTBEAT.
+    def generate():
+       try:
+          yield 'retry: 3000\n\n'
+          replayed = 0
+          for event in backlog:
+             replayed = event['id']
+             yield sse_message(event)
+          while not subscriber.overflowed:
+             try:
+                event = subscriber.queue.get(timeout=app.config['EVENTS_HEARTBEAT'])
+             except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+             if event['id'] > replayed:
+                yield sse_message(event)
+       finally:
+          event_hub.unsubscribe(subscriber)
+    return generate()
+
+# Archive
+
+# Completed and cancelled consultations older than ARCHIVE_AFTER_DAYS move to
+# consultation_archive in batches (one transaction each), so the hot table the
+# dashboards and bookings query only holds recent and upcoming rows. Counters
+# keep counting archived rows; the participants' versions are bumped because
+# their dashboards lose the moved rows. The newest consultation is never moved:
+# SQLite hands out max(id) + 1, which would reuse an archived id.
+
+ARCHIVED_STATUSES = ('completed', 'cancelled')
+ARCHIVE_COLUMNS = ('id', 'patient_id', 'doctor_id', 'scheduled_time', 'status', 'notes', 'diagnosis', 'created_at')
+
+def archive_consultations(days=None, max_batches=None):
+    """Move old consultations to the archive. Returns (moved, finished)."""
+    days = app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    hot = Consultation.__table__
+    columns = [hot.c[name] for name in ARCHIVE_COLUMNS]
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+       newest = select(func.max(hot.c.id)).scalar_subquery()
+       try:
+          rows = db.session.execute(
+             select(hot.c.id, hot.c.patient_id, hot.c.doctor_id)
+             .where(hot.c.status.in_(ARCHIVED_STATUSES), hot.c.scheduled_time < cutoff, hot.c.id < newest)
+             .order_by(hot.c.id)
+             .limit(app.config['ARCHIVE_BATCH_SIZE'])
+          ).all()
+          if not rows:
+             return moved, True
+          ids = [row.id for row in rows]
+          db.session.execute(
+             insert(ConsultationArchive).from_select(
+                list(ARCHIVE_COLUMNS) + ['archived_at'],
+                select(*columns, literal(datetime.utcnow()).label('archived_at')).where(hot.c.id.in_(ids))
+             )
+          )
+          db.session.execute(hot.delete().where(hot.c.id.in_(ids)))
+          participants = {row.patient_id for row in rows} | {row.doctor_id for row in rows}
+          bump_counters(db.session.connection(), _version_deltas('consultations', *participants))
+          db.session.commit()
+       except Exception:
+          db.session.rollback()
+          raise
+       moved += len(ids)
+       batches += 1
+    return moved, False
+
+def consultation_history(*criteria):
+    # Hot and archived consultations as one selectable; criteria(model) gives
+    # the WHERE conditions for each side so both can use their indexes.
+    sides = []
+    for model, archived in ((Consultation, false()), (ConsultationArchive, true())):
+       side = select(*[getattr(model, name) for name in ARCHIVE_COLUMNS], archived.label('archived'))
+       for condition in criteria:
+          side = side.where(condition(model))
+       sides.append(side)
+    return union_all(*sides).subquery('history')
+
+def patient_stats_query(patient_ids):
+    # Consultation count and latest consultation per patient, archive included
+    history = consultation_history(lambda model: model.patient_id.in_(patient_ids))
+    return select(
+       history.c.patient_id,
+       func.count(),
+       func.max(history.c.scheduled_time)
+    ).group_by(history.c.patient_id)
+
+def history_listing(*criteria):
+    # consultation_history() joined with both participants' names
+    history = consultation_history(*criteria)
+    patient = aliased(User)
+    doctor = aliased(User)
+    return select(
+       history,
+       patient.first_name.label('patient_first'), patient.last_name.label('patient_last'),
+       doctor.first_name.label('doctor_first'), doctor.last_name.label('doctor_last')
+    ).outerjoin(patient, history.c.patient_id == patient.id) \
+       .outerjoin(doctor, history.c.doctor_id == doctor.id) \
+       .order_by(history.c.scheduled_time.desc(), history.c.id.desc())
+
+def serialize_history(rows):
+    data = []
+    for row in rows:
+       patient_name = f"{row.patient_first} {row.patient_last}" if row.patient_first is not None else None
+       doctor_name = f"Dr. {row.doctor_first} {row.doctor_last}" if row.doctor_first is not None else None
+       info = consultation_dict(row, patient_name, doctor_name)
+       info['archived'] = bool(row.archived)
+       data.append(info)
+    return data
+
+def history_cursor(value):
+    # '<scheduled_time ISO>,<id>' of the last row on the previous page
+    if not value:
+       return None
+    scheduled, _, consultation_id = value.rpartition(',')
+    try:
+       return datetime.fromisoformat(scheduled), int(consultation_id)
+    except ValueError:
+       raise ValueError('Invalid cursor')
+
+def history_before(cursor):
+    scheduled, consultation_id = cursor
+    return lambda model: or_(
+       model.scheduled_time < scheduled,
+       and_(model.scheduled_time == scheduled, model.id < consultation_id)
+    )
+
+@app.cli.command('archive-consultations')
+@click.option('--days', type=int, default=None, help='Archive rows older than this many days (default ARCHIVE_AFTER_DAYS).')
+def archive_consultations_command(days):
+    """Move old completed/cancelled consultations to the archive table."""
+    started = time.perf_counter()
+    moved, _ = archive_consultations(days)
+    print(f"✅ Archived {moved} consultations in {time.perf_counter() - started:.1f}s")
+
+# Batch requests
+
+# /api/batch runs several GET requests in one round trip. Each sub-request is
+# dispatched in its own request context nested in the batch's app context, so
+# g (including the memoized current user) and the database session are shared
+# while auth, role checks and ETags work exactly as for a direct request. The
+# before/after_request hooks don't run for sub-requests: metrics and CORS
+# apply to the batch as a whole.
+
+class BatchError(Exception):
+    pass
+
+BATCH_HEADERS = ('If-None-Match',)
+
+def parse_batch(data):
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+       raise BatchError('requests must be a non-empty list')
+    if len(items) > app.config['BATCH_MAX_REQUESTS']:
+       raise BatchError(f"At most {app.config['BATCH_MAX_REQUESTS']} requests per batch")
+    batch = []
+    for item in items:
+       if isinstance(item, str):
+          item = {'path': item}
+       path = item.get('path') if isinstance(item, dict) else None
+       if not isinstance(path, str) or not path.startswith('/api/'):
+          raise BatchError('Each request needs a path under /api/')
+       headers = item.get('headers') or {}
+       if not isinstance(headers, dict):
+          raise BatchError('headers must be an object')
+       batch.append((path, {name: str(headers[name]) for name in BATCH_HEADERS if name in headers}))
+    return batch
+
+def run_batch_request(path, headers):
+    headers = dict(headers, Authorization=request.headers.get('Authorization', ''))
+    with app.test_request_context(path, method='GET', headers=headers):
+       try:
+          if request.endpoint == 'batch':
+             raise BatchError('Batches cannot be nested')
+          response = app.make_response(app.dispatch_request())
+       except BatchError as e:
+          return {'path': path, 'status': 400, 'headers': {}, 'body': {'error': str(e)}}
+       except HTTPException as e:
+          return {'path': path, 'status': e.code, 'headers': {}, 'body': {'error': e.name}}
+       try:
+          if response.is_streamed:
+             return {'path': path, 'status': 400, 'headers': {},
+                     'body': {'error': 'Streaming responses cannot be batched'}}
+          result = {'path': path, 'status': response.status_code, 'headers': {}, 'body': None}
+          if response.headers.get('ETag'):
+             result['headers']['ETag'] = response.headers['ETag']
+          if response.is_json:
+             result['body'] = response.get_json()
+          elif response.status_code != 304:
+             result['body'] = response.get_data(as_text=True)
+          return result
+       finally:
+          response.close()
+
+# Bulk import
+
+# Imports validate every row up front, resolve emails with set-based IN
+# lookups, hash passwords on a pool separate from logins and insert with executemany
+# batches. Rows that fail validation are reported back (1-based data row
+# numbers) and the rest are imported. Rows may carry a precomputed bcrypt
+# 'password_hash' instead of 'password' to skip hashing entirely.
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+CONSULTATION_STATUSES = ('scheduled', 'completed', 'cancelled')
+
+def read_import_rows(lines, fmt):
+    if fmt == 'csv':
+       for row in csv.DictReader(lines):
+          yield {key: value for key, value in row.items() if value not in (None, '')}
+       return
+    for line in lines:
+       line = line.strip()
+       if not line:
+          continue
+       try:
+          row = json.loads(line)
+       except ValueError:
+          row = None
+       yield row if isinstance(row, dict) else {'_error': 'Invalid JSON object'}
+
+def _check_types(row, text_fields, id_fields=()):
+    # NDJSON values can be any JSON type (CSV only yields strings), so report
+    # wrong ones as row errors instead of failing on .strip() or a set lookup
+    if '_error' in row:
+       return row
+    invalid = [f for f in text_fields if row.get(f) is not None and not isinstance(row[f], str)]
+    invalid += [f for f in id_fields if row.get(f) is not None
+                and (isinstance(row[f], bool) or not isinstance(row[f], (int, str)))]
+    return {'_error': f"Invalid {', '.join(invalid)}"} if invalid else row
+
+def _lookup_users(column, values):
+    # {value: (id, role)} for the users matching `values` on `column`
+    found = {}
+    values = list(values)
+    for i in range(0, len(values), 500):
+       chunk = values[i:i + 500]
+       for user_id, key, role in db.session.execute(
+          select(User.id, column, User.role).where(column.in_(chunk))
+       ):
+          found[key] = (user_id, role)
+    return found
+
+def _parse_datetime(value, field):
+    if isinstance(value, datetime) or value is None:
+       return value
+    try:
+       return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+       raise ValueError(f'Invalid {field}')
+
+def _insert_batches(model, rows):
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    for i in range(0, len(rows), batch_size):
+       db.session.execute(insert(model), rows[i:i + batch_size])
+
+def import_users(rows):
+    errors = []
+    valid = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+       row = _check_types(row, ('email', 'password', 'password_hash', 'first_name', 'last_name', 'role'))
+       if '_error' in row:
+          errors.append({'row': number, 'error': row['_error']})
+          continue
+       missing = [f for f in ('email', 'first_name', 'last_name') if not row.get(f)]
+       if not row.get('password') and not row.get('password_hash'):
+          missing.append('password')
+       if missing:
+          errors.append({'row': number, 'error': f"Missing {', '.join(missing)}"})
+          continue
+       role = row.get('role', 'patient')
+       if role not in ('admin', 'doctor', 'patient'):
+          errors.append({'row': number, 'error': 'Invalid role'})
+          continue
+       if row.get('password_hash') and not row['password_hash'].startswith('$2'):
+          errors.append({'row': number, 'error': 'password_hash is not a bcrypt hash'})
+          continue
+       email = row['email'].strip()
+       if email in seen:
+          errors.append({'row': number, 'error': 'Duplicate email in import'})
+          continue
+       try:
+          created_at = _parse_datetime(row.get('created_at'), 'created_at')
+       except ValueError as e:
+          errors.append({'row': number, 'error': str(e)})
+          continue
+       seen.add(email)
+       valid.append((number, email, role, created_at, row))
+
+    existing = _lookup_users(User.email, seen)
+    pending = []
+    for number, email, role, created_at, row in valid:
+       if email in existing:
+          errors.append({'row': number, 'error': 'Email already registered'})
+       else:
+          pending.append((email, role, created_at, row))
+
+    to_hash = [row['password'] for _, _, _, row in pending if not row.get('password_hash')]
+    hashed = iter(hash_passwords(to_hash))
+    records = []
+    role_counts = {}
+    for email, role, created_at, row in pending:
+       record = {
+          'email': email,
+          'role': role,
+          'first_name': row['first_name'],
+          'last_name': row['last_name'],
+          'password_hash': row.get('password_hash') or next(hashed),
+          'is_active': row.get('is_active', True) not in (False, 'false', 'False', '0', 0)
+       }
+       if created_at:
+          record['created_at'] = created_at
+       records.append(record)
+       role_counts[f'users:{role}'] = role_counts.get(f'users:{role}', 0) + 1
+
+    try:
+       _insert_batches(User, records)
+       if records:
+          role_counts['version:users'] = 1
+          bump_counters(db.session.connection(), role_counts)
+       db.session.commit()
+    except Exception:
+       db.session.rollback()
+       raise
+    errors.sort(key=lambda e: e['row'])
+    return {'imported': len(records), 'errors': errors}
+
+def _int_or_none(value):
+    try:
+       return int(value)
+    except (TypeError, ValueError):
+       return None
+
+def _resolve_participant(row, prefix, by_id, by_email):
+    if row.get(f'{prefix}_id') not in (None, ''):
+       entry = by_id.get(_int_or_none(row[f'{prefix}_id']))
+    else:
+       entry = by_email.get(row.get(f'{prefix}_email'))
+    if entry is None or entry[1] != prefix:
+       raise ValueError(f'Unknown {prefix}')
+    return entry[0]
+
+def _existing_import_slots(rows, by_id, by_email):
+    # Scheduled slots already taken for the doctors and time span in this import
+    doctor_ids = set()
+    times = []
+    for row in rows:
+       if row.get('status', 'scheduled') != 'scheduled':
+          continue
+       try:
+          doctor_ids.add(_resolve_participant(row, 'doctor', by_id, by_email))
+          times.append(_parse_datetime(row.get('scheduled_time'), 'scheduled_time'))
+       except ValueError:
+          continue
+    times = [t for t in times if t is not None]
+    if not doctor_ids or not times:
+       return set()
+    return booked_slots(doctor_ids, min(times), max(times))
+
+def import_consultations(rows):
+    errors = []
+    rows = [_check_types(row, ('patient_email', 'doctor_email', 'status', 'notes', 'diagnosis'),
+                         ('patient_id', 'doctor_id')) for row in rows]
+    roles = ('patient', 'doctor')
+    ids = {_int_or_none(row.get(f'{p}_id')) for row in rows for p in roles} - {None}
+    emails = {row.get(f'{p}_email') for row in rows for p in roles} - {None, ''}
+    by_id = _lookup_users(User.id, ids)
+    by_email = _lookup_users(User.email, emails)
+    scheduled_slots = _existing_import_slots(rows, by_id, by_email)
+    records = []
+    deltas = {}
+    daily = {}
+    for number, row in enumerate(rows, start=1):
+       if '_error' in row:
+          errors.append({'row': number, 'error': row['_error']})
+          continue
+       try:
+          patient_id = _resolve_participant(row, 'patient', by_id, by_email)
+          doctor_id = _resolve_participant(row, 'doctor', by_id, by_email)
+          if not row.get('scheduled_time'):
+             raise ValueError('Missing scheduled_time')
+          scheduled_time = _parse_datetime(row['scheduled_time'], 'scheduled_time')
+          created_at = _parse_datetime(row.get('created_at'), 'created_at')
+       except ValueError as e:
+          errors.append({'row': number, 'error': str(e)})
+          continue
+       status = row.get('status', 'scheduled')
+       if status not in CONSULTATION_STATUSES:
+          errors.append({'row': number, 'error': 'Invalid status'})
+          continue
+       if status == 'scheduled':
+          if slot_start(scheduled_time) != scheduled_time:
+             minutes = app.config['CONSULTATION_SLOT_MINUTES']
+             errors.append({'row': number, 'error': f'scheduled_time must start on a {minutes}-minute slot'})
+             continue
+          if (doctor_id, scheduled_time) in scheduled_slots:
+             errors.append({'row': number, 'error': 'Doctor is already booked for this slot'})
+             continue
+          scheduled_slots.add((doctor_id, scheduled_time))
+       record = {
+          'patient_id': patient_id,
+          'doctor_id': doctor_id,
+          'scheduled_time': scheduled_time,
+          'status': status,
+          'notes': row.get('notes'),
+          'diagnosis': row.get('diagnosis')
+       }
+       if created_at:
+          record['created_at'] = created_at
+       records.append(record)
+       for key in ('consultations', f'consultations:{status}'):
+          deltas[key] = deltas.get(key, 0) + 1
+       deltas[f'version:user:{patient_id}'] = 1
+       deltas[f'version:user:{doctor_id}'] = 1
+       key = daily_stat_key(doctor_id, scheduled_time, status)
+       daily[key] = daily.get(key, 0) + 1
+
+    try:
+       _insert_batches(Consultation, records)
+       if records:
+          deltas['version:consultations'] = 1
+          bump_counters(db.session.connection(), deltas)
+          bump_daily_stats(db.session.connection(), daily)
+       db.session.commit()
+    except Exception:
+       db.session.rollback()
+       raise
+    return {'imported': len(records), 'errors': errors}
+
+def import_format(default='ndjson'):
+    fmt = request.args.get('format')
+    if not fmt:
+       fmt = 'csv' if 'csv' in (request.content_type or '') else default
+    if fmt not in IMPORT_FORMATS:
+       raise ValueError('Invalid format, expected ndjson or csv')
+    return fmt
+
+def _import_command(importer, path, fmt, workers):
+    if workers is not None:
+       app.config['IMPORT_HASH_WORKERS'] = workers
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+    started = time.monotonic()
+    with open(path, newline='', encoding='utf-8') as f:
+       report = importer(list(read_import_rows(f, fmt)))
+    elapsed = time.monotonic() - started
+    for error in report['errors']:
+       print(f"⚠️  Row {error['row']}: {error['error']}")
+    print(f"✅ Imported {report['imported']} rows in {elapsed:.1f}s, {len(report['errors'])} errors")
+
+@app.cli.command('import-users')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS))
+@click.option('--workers', type=int, help='bcrypt processes (defaults to IMPORT_HASH_WORKERS)')
+def import_users_command(path, fmt, workers):
+    """Bulk import users from a CSV or NDJSON file."""
+    _import_command(import_users, path, fmt, workers)
+
+@app.cli.command('import-consultations')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS))
+def import_consultations_command(path, fmt):
+    """Bulk import consultations from a CSV or NDJSON file."""
+    _import_command(import_consultations, path, fmt, None)
+
 # Routes
 
 @app.route('/api/register', methods=['POST'])
@@ -147,6 +2521,9 @@ def register():
        db.session.add(user)
        db.session.commit()
        return jsonify({'message': 'User registered successfully', 'user': user.to_dict()}), 201
+    except PasswordHasherBusy:
+       db.session.rollback()
+       return busy_response()
     except Exception:
        db.session.rollback()
        app.logger.exception("Register error")
@@ -160,116 +2537,398 @@ def login():
        password = data.get('password')
        if not email or not password:
           return jsonify({'error': 'Email and password required'}), 400
+       throttled = throttle_login(email)
+       if throttled:
+          return throttled
 
        user = User.query.filter_by(email=email).first()
        if not user or not user.check_password(password):
           return jsonify({'error': 'Invalid email or password'}), 401
        if not user.is_active:
           return jsonify({'error': 'Account is deactivated'}), 401
+       if password_needs_rehash(user.password_hash):
+          # Work factor changed since this hash was stored; upgrade it transparently
+          user.set_password(password)
+          db.session.commit()
 
        access_token = create_access_token(
           identity=str(user.id),  # keep as string for compatibility
           additional_claims={'role': user.role, 'email': user.email}
        )
        return jsonify({'access_token': access_token, 'user': user.to_dict()}), 200
+    except PasswordHasherBusy:
+       db.session.rollback()
+       return busy_response()
     except Exception:
+       db.session.rollback()
        app.logger.exception("Login error")
        return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/dashboard/admin', methods=['GET'])
 @role_required('admin')
+@read_replica
+@conditional_get('version:users', 'version:consultations')
 def admin_dashboard(current_user):
     try:
-       total_doctors = User.query.filter_by(role='doctor').count()
-       total_patients = User.query.filter_by(role='patient').count()
-       total_consultations = Consultation.query.count()
-       active_consultations = Consultation.query.filter_by(status='scheduled').count()
-
-       recent_consultations = Consultation.query.order_by(Consultation.created_at.desc()).limit(10).all()
-       recent_data = [c.to_dict() for c in recent_consultations]
-
-       return jsonify({
-          'stats': {
-             'total_doctors': total_doctors,
-             'total_patients': total_patients,
-             'total_consultations': total_consultations,
-             'active_consultations': active_consultations
-          },
-          'recent_consultations': recent_data
-       }), 200
+       return run_read_view(admin_dashboard_view, current_user)
     except Exception:
        app.logger.exception("Admin dashboard error")
        return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/dashboard/patient', methods=['GET'])
-@role_required('patient')
+@role_required('patient', user_row=True)
+@read_replica
+@conditional_get('version:user:{user_id}')
 def patient_dashboard(current_user):
     try:
-       upcoming = Consultation.query.filter_by(patient_id=current_user.id, status='scheduled') \
-          .order_by(Consultation.scheduled_time.asc()).all()
-       past = Consultation.query.filter_by(patient_id=current_user.id, status='completed') \
-          .order_by(Consultation.scheduled_time.desc()).all()
-
-       return jsonify({
-          'upcoming_consultations': [c.to_dict() for c in upcoming],
-          'past_consultations': [c.to_dict() for c in past],
-          'patient_info': current_user.to_dict()
-       }), 200
+       return run_read_view(patient_dashboard_view, current_user)
     except Exception:
        app.logger.exception("Patient dashboard error")
        return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/dashboard/doctor', methods=['GET'])
-@role_required('doctor')
+@role_required('doctor', user_row=True)
+@read_replica
+@conditional_get('version:user:{user_id}')
 def doctor_dashboard(current_user):
     try:
-       upcoming = Consultation.query.filter_by(doctor_id=current_user.id, status='scheduled') \
-          .order_by(Consultation.scheduled_time.asc()).all()
-       recent = Consultation.query.filter_by(doctor_id=current_user.id, status='completed') \
-          .order_by(Consultation.scheduled_time.desc()).limit(10).all()
-
-       return jsonify({
-          'upcoming_consultations': [c.to_dict() for c in upcoming],
-          'recent_consultations': [c.to_dict() for c in recent],
-          'doctor_info': current_user.to_dict()
-       }), 200
+       return run_read_view(doctor_dashboard_view, current_user)
     except Exception:
        app.logger.exception("Doctor dashboard error")
        return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/users', methods=['GET'])
 @role_required('admin')
+@read_replica
+@conditional_get('version:users')
 def get_users(current_user):
     try:
-       users = User.query.all()
-       return jsonify({'users': [u.to_dict() for u in users]}), 200
+       return run_read_view(users_view, current_user)
     except Exception:
        app.logger.exception("Get users error")
        return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/patients', methods=['GET'])
-@jwt_required()
-def get_patients():
-    try:
-       current = get_current_user()
-       if not current or current.role not in ['admin', 'doctor']:
-          return jsonify({'error': 'Access denied'}), 403
-
-       patients = User.query.filter_by(role='patient').all()
-       data = []
-       for p in patients:
-          consultation_count = Consultation.query.filter_by(patient_id=p.id).count()
-          last = Consultation.query.filter_by(patient_id=p.id).order_by(Consultation.scheduled_time.desc()).first()
-          info = p.to_dict()
-          info['consultation_count'] = consultation_count
-          info['last_consultation'] = last.scheduled_time.isoformat() if last else None
-          data.append(info)
-
-       return jsonify({'patients': data, 'total_count': len(data)}), 200
+@role_required('admin', 'doctor')
+@read_replica
+@conditional_get('version:users', 'version:consultations')
+def get_patients(current_user):
+    try:
+       return run_read_view(patients_view, current_user)
     except Exception:
        app.logger.exception("Get patients error")
        return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/consultations', methods=['POST'])
+@role_required('patient', 'doctor', 'admin', user_row=True)
+def create_consultation(current_user):
+    try:
+       consultation = book_consultation(current_user, request.get_json() or {})
+       return jsonify({'message': 'Consultation booked', 'consultation': consultation_response(consultation)}), 201
+    except BookingError as e:
+       db.session.rollback()
+       return jsonify({'error': str(e)}), e.status
+    except Exception:
+       db.session.rollback()
+       app.logger.exception("Book consultation error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/consultations/<int:consultation_id>', methods=['PUT'])
+@role_required('patient', 'doctor', 'admin', user_row=True)
+def update_consultation(current_user, consultation_id):
+    try:
+       consultation = reschedule_consultation(current_user, consultation_id, request.get_json() or {})
+       return jsonify({'message': 'Consultation rescheduled', 'consultation': consultation_response(consultation)}), 200
+    except BookingError as e:
+       db.session.rollback()
+       return jsonify({'error': str(e)}), e.status
+    except Exception:
+       db.session.rollback()
+       app.logger.exception("Reschedule consultation error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/consultations/<int:consultation_id>/cancel', methods=['POST'])
+@role_required('patient', 'doctor', 'admin', user_row=True)
+def cancel_consultation_route(current_user, consultation_id):
+    try:
+       consultation = cancel_consultation(current_user, consultation_id)
+       return jsonify({'message': 'Consultation cancelled', 'consultation': consultation_response(consultation)}), 200
+    except BookingError as e:
+       db.session.rollback()
+       return jsonify({'error': str(e)}), e.status
+    except Exception:
+       db.session.rollback()
+       app.logger.exception("Cancel consultation error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/consultations/history', methods=['GET'])
+@role_required('admin', 'doctor', 'patient')
+@read_replica
+@conditional_get('version:consultations')
+def get_consultation_history(current_user):
+    try:
+       try:
+          limit, _ = get_page_args()
+          cursor = history_cursor(request.args.get('before'))
+       except ValueError as e:
+          return jsonify({'error': str(e)}), 400
+
+       criteria = [lambda model: model.status.in_(ARCHIVED_STATUSES)]
+       if current_user.role == 'patient':
+          criteria.append(lambda model: model.patient_id == current_user.id)
+       elif current_user.role == 'doctor':
+          criteria.append(lambda model: model.doctor_id == current_user.id)
+       else:
+          for name in ('patient_id', 'doctor_id'):
+             value = request.args.get(name)
+             if not value:
+                continue
+             if not value.isdigit():
+                return jsonify({'error': f'Invalid {name}'}), 400
+             criteria.append(lambda model, name=name, user_id=int(value): getattr(model, name) == user_id)
+       if cursor:
+          criteria.append(history_before(cursor))
+
+       rows = db.session.execute(history_listing(*criteria).limit(limit + 1)).all()
+       has_more = len(rows) > limit
+       rows = rows[:limit]
+       next_cursor = f"{rows[-1].scheduled_time.isoformat()},{rows[-1].id}" if has_more else None
+       return jsonify({'consultations': serialize_history(rows), 'next_cursor': next_cursor}), 200
+    except Exception:
+       app.logger.exception("Consultation history error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/analytics/consultations', methods=['GET'])
+@role_required('admin', 'doctor')
+@read_replica
+def get_consultation_analytics(current_user):
+    try:
+       today = datetime.utcnow().date()
+       try:
+          start, end = analytics_range(today)
+       except ValueError as e:
+          return jsonify({'error': str(e)}), 400
+
+       doctor_id = None
+       if current_user.role == 'doctor':
+          doctor_id = current_user.id
+       elif request.args.get('doctor_id'):
+          if not request.args['doctor_id'].isdigit():
+             return jsonify({'error': 'Invalid doctor_id'}), 400
+          doctor_id = int(request.args['doctor_id'])
+       return jsonify(consultation_analytics(start, end, today, doctor_id)), 200
+    except Exception:
+       app.logger.exception("Consultation analytics error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/doctors', methods=['GET'])
+@role_required('patient', 'doctor', 'admin')
+def get_doctors(current_user):
+    try:
+       return run_read_view(doctors_view, current_user)
+    except Exception:
+       app.logger.exception("Get doctors error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/doctors/<int:doctor_id>/slots', methods=['GET'])
+@role_required('patient', 'doctor', 'admin')
+def get_doctor_slots(current_user, doctor_id):
+    # Booked slots on ?date=YYYY-MM-DD, for the booking UI to grey out
+    try:
+       try:
+          day = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d')
+       except ValueError:
+          return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+       taken = booked_slots([doctor_id], day, day + timedelta(days=1) - timedelta(microseconds=1))
+       return jsonify({
+          'doctor_id': doctor_id,
+          'date': day.date().isoformat(),
+          'slot_minutes': app.config['CONSULTATION_SLOT_MINUTES'],
+          'booked': sorted(t.isoformat() for _, t in taken)
+       }), 200
+    except Exception:
+       app.logger.exception("Get doctor slots error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/events', methods=['GET'])
+# EventSource can't send headers, so browsers pass the token as ?jwt=
+@role_required('admin', 'doctor', 'patient', locations=['headers', 'query_string'])
+def consultation_events(current_user):
+    try:
+       last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+       try:
+          after = int(last_event_id) if last_event_id else None
+       except ValueError:
+          return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+       # Subscribe before replaying so nothing falls between the two
+       subscriber = event_hub.subscribe(EventSubscriber(event_audience(current_user)))
+       try:
+          backlog = replay_events(current_user, after) if after is not None else []
+       except Exception:
+          event_hub.unsubscribe(subscriber)
+          raise
+       db.session.close()
+
+       response = Response(stream_events(subscriber, backlog), mimetype='text/event-stream')
+       # Also covers a response closed before the stream ever started
+       response.call_on_close(lambda: event_hub.unsubscribe(subscriber))
+       response.headers['Cache-Control'] = 'no-cache'
+       response.headers['X-Accel-Buffering'] = 'no'
+       return response
+    except Exception:
+       app.logger.exception("Event stream error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/batch', methods=['POST'])
+@role_required('patient', 'doctor', 'admin')
+def batch(current_user):
+    try:
+       try:
+          sub_requests = parse_batch(request.get_json(silent=True))
+       except BatchError as e:
+          return jsonify({'error': str(e)}), 400
+       responses = []
+       for path, headers in sub_requests:
+          try:
+             responses.append(run_batch_request(path, headers))
+          except Exception:
+             db.session.rollback()
+             app.logger.exception("Batch sub-request error: %s", path)
+             responses.append({'path': path, 'status': 500, 'headers': {}, 'body': {'error': 'Internal server error'}})
+       return jsonify({'responses': responses}), 200
+    except Exception:
+       app.logger.exception("Batch error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/counters/reconcile', methods=['POST'])
+@role_required('admin', user_row=True)
+def reconcile_counters_route(current_user):
+    try:
+       reconcile_counters()
+       counters = dict(db.session.query(StatCounter.name, StatCounter.value))
+       return jsonify({'message': 'Counters reconciled', 'counters': counters}), 200
+    except Exception:
+       app.logger.exception("Reconcile counters error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/archive', methods=['POST'])
+@role_required('admin', user_row=True)
+def run_archive(current_user):
+    try:
+       try:
+          max_batches = int(request.args.get('max_batches', 10))
+       except ValueError:
+          return jsonify({'error': 'Invalid max_batches'}), 400
+       if max_batches < 1:
+          return jsonify({'error': 'Invalid max_batches'}), 400
+       moved, finished = archive_consultations(max_batches=max_batches)
+       return jsonify({'moved': moved, 'finished': finished}), 200
+    except Exception:
+       app.logger.exception("Archive consultations error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/user-cache', methods=['GET'])
+@role_required('admin')
+def user_cache_stats(current_user):
+    return jsonify(user_cache.stats()), 200
+
+@app.route('/api/admin/import/users', methods=['POST'])
+@role_required('admin', user_row=True)
+def import_users_route(current_user):
+    try:
+       try:
+          fmt = import_format()
+       except ValueError as e:
+          return jsonify({'error': str(e)}), 400
+       lines = io.StringIO(request.get_data(as_text=True))
+       rows = list(read_import_rows(lines, fmt))
+       # Hashing runs inside the request, so big password imports go to the CLI
+       to_hash = sum(1 for row in rows if row.get('password') and not row.get('password_hash'))
+       if to_hash > app.config['IMPORT_MAX_HASHES']:
+          return jsonify({
+             'error': f"At most {app.config['IMPORT_MAX_HASHES']} passwords can be hashed per request, "
+                      "send password_hash or use `flask import-users`"
+          }), 413
+       return jsonify(import_users(rows)), 200
+    except Exception:
+       app.logger.exception("Import users error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/import/consultations', methods=['POST'])
+@role_required('admin', user_row=True)
+def import_consultations_route(current_user):
+    try:
+       try:
+          fmt = import_format()
+       except ValueError as e:
+          return jsonify({'error': str(e)}), 400
+       lines = io.StringIO(request.get_data(as_text=True))
+       return jsonify(import_consultations(list(read_import_rows(lines, fmt)))), 200
+    except Exception:
+       app.logger.exception("Import consultations error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/export/consultations', methods=['GET'])
+@role_required('admin')
+def export_consultations(current_user):
+    try:
+       try:
+          fmt, start, end = export_args()
+       except ValueError as e:
+          return jsonify({'error': str(e)}), 400
+
+       criteria = []
+       if start:
+          criteria.append(lambda model: model.scheduled_time >= start)
+       if end:
+          criteria.append(lambda model: model.scheduled_time < end)
+       # Archived consultations are exported alongside the hot ones
+       history = consultation_history(*criteria)
+       patient = aliased(User)
+       doctor = aliased(User)
+       statement = select(
+          history.c.id,
+          history.c.patient_id,
+          (patient.first_name + ' ' + patient.last_name).label('patient_name'),
+          history.c.doctor_id,
+          (doctor.first_name + ' ' + doctor.last_name).label('doctor_name'),
+          history.c.scheduled_time,
+          history.c.status,
+          history.c.notes,
+          history.c.diagnosis,
+          history.c.created_at,
+          history.c.archived
+       ).outerjoin(patient, history.c.patient_id == patient.id) \
+          .outerjoin(doctor, history.c.doctor_id == doctor.id) \
+          .order_by(history.c.id)
+       return stream_export(statement, fmt, 'consultations')
+    except Exception:
+       app.logger.exception("Export consultations error")
+       return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/admin/export/users', methods=['GET'])
+@role_required('admin')
+def export_users(current_user):
+    try:
+       try:
+          fmt, start, end = export_args()
+       except ValueError as e:
+          return jsonify({'error': str(e)}), 400
+
+       statement = select(
+          User.id, User.email, User.role, User.first_name, User.last_name,
+          User.created_at, User.is_active
+       ).order_by(User.id)
+       if start:
+          statement = statement.where(User.created_at >= start)
+       if end:
+          statement = statement.where(User.created_at < end)
+       return stream_export(statement, fmt, 'users')
+    except Exception:
+       app.logger.exception("Export users error")
+       return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/test-jwt', methods=['GET'])
 @jwt_required()
 def test_jwt():
@@ -289,6 +2948,22 @@ def test_no_jwt():
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'Kalafo API is running'}), 200
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token:
+       allowed = request.headers.get('Authorization') == f'Bearer {token}'
+    else:
+       # Without a token only a scraper on the same host, not a proxied client
+       allowed = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+    if not allowed:
+       return jsonify({'error': 'Access denied'}), 403
+    try:
+       return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+    except Exception:
+       app.logger.exception("Metrics error")
+       return jsonify({'error': 'Internal server error'}), 500
+
 @app.route('/api/me', methods=['GET'])
 @jwt_required()
 def me():
@@ -303,15 +2978,46 @@ def me():
 
 # App factory and main
 
-def create_app():
+# Schema changes are a deploy step (`flask --app app db-upgrade`, the release
+# phase in the Procfile), not part of booting a worker. The app is built at
+# import, so `gunicorn --preload` imports it once in the master and forks
+# ready workers that share its memory. Anything holding sockets or
+# per-process state is reset in each child; the bcrypt pool, the events
+# poller and the login throttle store are already created lazily per process.
+
+def _reset_after_fork():
+    # Only the forking thread survives in the child, so a lock another thread
+    # held at that moment would stay held for good. Every module-level lock is
+    # replaced before the state it guards is touched.
+    global _hasher_lock, _replica_lock
+    _hasher_lock = threading.Lock()
+    _replica_lock = threading.Lock()
+    metrics._lock = threading.Lock()
+    user_cache._lock = threading.Lock()
+    event_hub._lock = threading.Lock()
+    # Pooled connections belong to the parent: dispose(close=False) drops them
+    # from this process's pools without closing the parent's sockets
     with app.app_context():
-       db.create_all()
-       app.logger.info("Database tables ensured")
+       for engine in db.engines.values():
+          engine.dispose(close=False)
+    _replica_health.update(checked=None, healthy=False)
+    metrics.reset()
+    user_cache.clear()
+    event_hub._subscribers = {}  # the parent's streams, not this process's
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def create_app():
+    # Factory for servers that expect one (`gunicorn 'app:create_app()'`).
+    # It does not touch the database; run db-upgrade before starting workers.
     return app
 
 if __name__ == '__main__':
+    # Spawned bcrypt processes re-import __main__, which here is this whole app
+    # module, so the development server hashes inline; run gunicorn for the pool
+    app.config['BCRYPT_POOL_SIZE'] = 0
     with app.app_context():
-       db.create_all()
-       app.logger.info("Database tables ensured")
+       run_migrations()
+       app.logger.info("Database schema ensured")
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,382 @@
+"""Async (ASGI) entry point.
+
+    uvicorn asgi:application --workers 2
+
+The read routes below run natively on an event loop with async SQLAlchemy
+sessions (aiosqlite for SQLite, asyncpg for Postgres), so a slow query parks
+a coroutine instead of a worker thread. Every other route, and every write,
+is handed to the Flask app in app.py, which runs in a thread pool. /api/events
+streams are native too: an idle stream is a parked coroutine fed by the
+process's event poller thread, not a thread of its own. The dashboards and
+listings run app.py's read views (the same statements and bodies), and each
+native route takes its roles, token locations, @read_replica and ETag keys
+from the decorators of its Flask route, so the two paths can't drift. Both
+share the user cache, metrics and replica health of the process.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from flask_cors.core import try_match_any
+from flask_jwt_extended import decode_token
+from jwt import ExpiredSignatureError
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (CORS_ORIGINS, CachedUser, EventSubscriber, User, admin_dashboard_view, app, counter_values,
+                 counters_query, db, doctor_dashboard_view, doctors_view, engine_options, event_audience,
+                 event_hub, mark_replica_down, metrics, patient_dashboard_view, patients_view, replay_query,
+                 replica_available, sql_totals, sqlite_pragmas, sse_message, TokenUser, user_cache, users_view,
+                 view_etag)
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+# Threads running the Flask app for the routes that fall through
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 8))
+
+async_session = async_sessionmaker(expire_on_commit=False)
+replica_session = async_sessionmaker(expire_on_commit=False)
+
+def create_engine(bind_key=None):
+    with app.app_context():
+       url = db.engines[bind_key].url  # Flask-SQLAlchemy resolves relative SQLite paths
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+       raise RuntimeError(f"No async driver configured for {backend}")
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    engine = create_async_engine(url, **engine_options(url.render_as_string(hide_password=False)))
+    if backend == 'sqlite':
+       @event.listens_for(engine.sync_engine, 'connect')
+       def _configure_sqlite(dbapi_connection, connection_record):
+          cursor = dbapi_connection.cursor()
+          try:
+             for pragma in sqlite_pragmas():
+                cursor.execute(pragma)
+          finally:
+             cursor.close()
+    return engine
+
+@asynccontextmanager
+async def lifespan(application):
+    engines = [create_engine()]
+    async_session.configure(bind=engines[0])
+    if app.config['DATABASE_READ_URL']:
+       engines.append(create_engine('replica'))
+       replica_session.configure(bind=engines[1])
+    try:
+       yield
+    finally:
+       for engine in engines:
+          await engine.dispose()
+
+class FlaskJSONResponse(JSONResponse):
+    # Byte-for-byte the body jsonify() produces in app.py
+    def render(self, content):
+       return app.json.response(content).get_data()
+
+def error(message, status, key='error'):
+    return FlaskJSONResponse({key: message}, status_code=status)
+
+# Auth
+
+def _header_token(request):
+    header = request.headers.get('Authorization')
+    if not header:
+       return None, 'Missing Authorization Header'
+    scheme, _, token = header.partition(' ')
+    if scheme != 'Bearer' or not token:
+       return None, "Missing 'Bearer' type in 'Authorization' header. Expected 'Authorization: Bearer <JWT>'"
+    return token, None
+
+def _query_string_token(request):
+    token = request.query_params.get('jwt')
+    if not token:
+       return None, "Missing 'jwt' query paramater"
+    return token, None
+
+TOKEN_LOCATIONS = {'headers': _header_token, 'query_string': _query_string_token}
+
+def authenticate(request, locations=('headers',)):
+    # Mirrors @jwt_required() from Flask-JWT-Extended: returns (claims, None)
+    # or (None, error response) with the same status codes and messages.
+    missing = []
+    for location in locations:
+       token, problem = TOKEN_LOCATIONS[location](request)
+       if token:
+          break
+       missing.append(problem)
+    else:
+       if len(locations) > 1:
+          message = f"Missing JWT in {', '.join(locations[:-1])} or {locations[-1]} ({'; '.join(missing)})"
+       else:
+          message = missing[0]
+       return None, error(message, 401, 'msg')
+    try:
+       with app.app_context():
+          claims = decode_token(token)
+    except ExpiredSignatureError:
+       return None, error('Token has expired', 401, 'msg')
+    except Exception as e:
+       return None, error(str(e), 422, 'msg')
+    if claims.get('type') != 'access':
+       return None, error('Only non-refresh tokens are allowed', 422, 'msg')
+    return claims, None
+
+async def load_user(session, identity):
+    try:
+       user_id = int(identity)
+    except (TypeError, ValueError):
+       return None
+    user = user_cache.get(user_id)
+    if user is not None:
+       return user
+    row = await session.get(User, user_id)
+    if row is None:
+       return None
+    user = CachedUser(row)
+    if app.config['USER_CACHE_SIZE'] > 0:
+       user_cache.put(user)
+    return user
+
+def route(endpoint):
+    # Applies the decorators of the Flask route `endpoint` to an async view:
+    # @role_required's roles, user_row and token locations (@jwt_required()
+    # alone checks only the token) and @read_replica. The endpoint name is
+    # also used for metrics and ETags.
+    view = app.view_functions[endpoint]
+    allowed_roles = getattr(view, 'allowed_roles', ())
+    user_row = getattr(view, 'user_row', False)
+    locations = tuple(getattr(view, 'token_locations', None) or app.config['JWT_TOKEN_LOCATION'])
+    replica = getattr(view, 'uses_replica', False)
+
+    def decorator(fn):
+       @wraps(fn)
+       async def wrapper(request):
+          started = time.perf_counter()
+          totals = [0, 0.0]  # statements and their time, from app.py's listeners
+          token = sql_totals.set(totals)
+          try:
+             response = await _dispatch(fn, request, endpoint, allowed_roles, user_row, locations, replica)
+          finally:
+             sql_totals.reset(token)
+          metrics.inc('kalafo_http_requests_total',
+                      {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+          metrics.observe('kalafo_http_request_duration_seconds', {'endpoint': endpoint},
+                          time.perf_counter() - started)
+          if totals[0]:
+             metrics.inc('kalafo_sql_statements_total', {'endpoint': endpoint}, totals[0])
+             metrics.inc('kalafo_sql_duration_seconds_total', {'endpoint': endpoint}, totals[1])
+          try:
+             metrics.flush()
+          except OSError:
+             app.logger.exception("Metrics flush error")
+          return response
+       return wrapper
+    return decorator
+
+def _replica_available():
+    with app.app_context():
+       return replica_available()
+
+async def _run_view(fn, request, session, user, replica):
+    # The user lookup above stays on the primary, like role_required before
+    # @read_replica. A replica query that fails marks the replica down and
+    # the view runs again on the primary.
+    if not replica or not app.config['DATABASE_READ_URL'] or not await asyncio.to_thread(_replica_available):
+       return await fn(request, session, user)
+    try:
+       async with replica_session() as read_session:
+          return await fn(request, read_session, user)
+    except DBAPIError:
+       mark_replica_down()
+       return await fn(request, session, user)
+
+async def _dispatch(fn, request, endpoint, allowed_roles, user_row, locations, replica):
+    claims, failure = authenticate(request, locations)
+    if failure is not None:
+       return failure
+    role = None
+    if allowed_roles and app.config['AUTH_TRUST_TOKEN_CLAIMS'] and not user_row:
+       role = claims.get('role')
+    if role and role not in allowed_roles:
+       return error('Access denied', 403)
+    try:
+       async with async_session() as session:
+          if role:
+             # role_required()'s trust mode: views that only use the id and
+             # role are authorized from the claims without loading the user
+             try:
+                user_id = int(claims.get('sub'))
+             except (TypeError, ValueError):
+                return error('User not found', 404)
+             return await _run_view(fn, request, session, TokenUser(user_id, role), replica)
+          user = await load_user(session, claims.get('sub'))
+          if not user:
+             return error('User not found', 404)
+          if allowed_roles:
+             if user.role not in allowed_roles:
+                return error('Access denied', 403)
+             if not user.is_active:
+                return error('Account is deactivated', 401)
+          return await _run_view(fn, request, session, user, replica)
+    except Exception:
+       app.logger.exception("%s error", endpoint)
+       return error('Internal server error', 500)
+
+async def conditional(request, session, endpoint, current_user, version_keys, render):
+    # conditional_get() from app.py: the ETags are interchangeable between the two
+    keys = [key.format(user_id=current_user.id) for key in version_keys]
+    versions = counter_values((await session.execute(counters_query(*keys))).all(), keys)
+    etag = view_etag(endpoint, current_user.id, request.scope['query_string'], [versions[key] for key in keys])
+    tags = [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+    if f'W/"{etag}"' in tags or f'"{etag}"' in tags or '*' in tags:
+       response = Response(status_code=304)
+    else:
+       response = await render()
+       if response.status_code != 200:
+          return response
+    response.headers['ETag'] = f'W/"{etag}"'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+async def run_read_view(view, request, session, current_user):
+    # run_read_view() from app.py, awaiting each statement on the async session
+    plan = view(current_user, request.query_params, session.bind.dialect.name)
+    rows = None
+    try:
+       while True:
+          step = plan.send(rows)
+          statement, params = step if isinstance(step, tuple) else (step, None)
+          rows = (await session.execute(statement, params)).all()
+    except StopIteration as done:
+       body, status = done.value
+    return FlaskJSONResponse(body, status_code=status)
+
+def read_view(endpoint, view):
+    # Serve one of app.py's read views natively, with the ETag keys of the
+    # Flask route's @conditional_get
+    version_keys = getattr(app.view_functions[endpoint], 'version_keys', None)
+
+    @route(endpoint)
+    async def serve(request, session, current_user):
+       async def render():
+          return await run_read_view(view, request, session, current_user)
+       if version_keys is None:
+          return await render()
+       return await conditional(request, session, endpoint, current_user, version_keys, render)
+    return serve
+
+# Routes
+
+@route('me')
+async def me(request, session, current_user):
+    return FlaskJSONResponse(current_user.to_dict())
+
+class AsyncEventSubscriber(EventSubscriber):
+    # Filled by the event hub's poller thread, drained on the event loop
+    def __init__(self, keys):
+       self.keys = keys
+       self.loop = asyncio.get_running_loop()
+       self.queue = asyncio.Queue(maxsize=app.config['EVENTS_QUEUE_SIZE'])
+       self.overflowed = False
+
+    def put(self, event):
+       try:
+          self.loop.call_soon_threadsafe(self._put, event)
+       except RuntimeError:
+          pass  # the loop has closed, so has the stream
+
+    def _put(self, event):
+       try:
+          self.queue.put_nowait(event)
+       except asyncio.QueueFull:
+          self.overflowed = True
+
+async def stream_events(subscriber, backlog):
+    # stream_events() from app.py; a disconnect cancels the generator
+    try:
+       yield 'retry: 3000\n\n'
+       replayed = 0
+       for event in backlog:
+          replayed = event['id']
+          yield sse_message(event)
+       while not subscriber.overflowed:
+          try:
+             event = await asyncio.wait_for(subscriber.queue.get(), app.config['EVENTS_HEARTBEAT'])
+          except asyncio.TimeoutError:
+             yield ': keepalive\n\n'
+             continue
+          if event['id'] > replayed:
+             yield sse_message(event)
+    finally:
+       event_hub.unsubscribe(subscriber)
+
+# EventSource can't send headers, so browsers pass the token as ?jwt= (the
+# Flask route's token locations)
+@route('consultation_events')
+async def consultation_events(request, session, current_user):
+    last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+    try:
+       after = int(last_event_id) if last_event_id else None
+    except ValueError:
+       return error('Invalid Last-Event-ID', 400)
+
+    # Subscribe before replaying so nothing falls between the two
+    subscriber = event_hub.subscribe(AsyncEventSubscriber(event_audience(current_user)))
+    try:
+       backlog = [e.to_dict() for e in await session.scalars(replay_query(current_user, after))] \
+          if after is not None else []
+    except Exception:
+       event_hub.unsubscribe(subscriber)
+       raise
+    return StreamingResponse(stream_events(subscriber, backlog), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+async def health_check(request):
+    return FlaskJSONResponse({'status': 'healthy', 'message': 'Kalafo API is running'})
+
+class FlaskCORSMiddleware(CORSMiddleware):
+    # Flask-CORS covers the routes Flask serves (and every OPTIONS preflight,
+    # since the native routes only accept GET). The native ones ask
+    # Flask-CORS's own matcher, so an origin is allowed on both paths or on
+    # neither.
+    def is_allowed_origin(self, origin):
+       return try_match_any(origin, CORS_ORIGINS)
+
+cors = Middleware(FlaskCORSMiddleware, allow_origins=CORS_ORIGINS, allow_credentials=True)
+
+# Gzip above the same threshold as app.py's compression hook (no brotli here)
+compression = [Middleware(GZipMiddleware, minimum_size=app.config['COMPRESS_MIN_SIZE'],
+                          compresslevel=app.config['COMPRESS_GZIP_LEVEL'])] if app.config['COMPRESS_MIN_SIZE'] else []
+
+def native(path, endpoint):
+    return Route(path, endpoint, methods=['GET'], middleware=[cors, *compression])
+
+application = Starlette(
+    routes=[
+       native('/api/health', health_check),
+       native('/api/me', me),
+       native('/api/dashboard/admin', read_view('admin_dashboard', admin_dashboard_view)),
+       native('/api/dashboard/patient', read_view('patient_dashboard', patient_dashboard_view)),
+       native('/api/dashboard/doctor', read_view('doctor_dashboard', doctor_dashboard_view)),
+       native('/api/users', read_view('get_users', users_view)),
+       native('/api/patients', read_view('get_patients', patients_view)),
+       native('/api/doctors', read_view('get_doctors', doctors_view)),
+       native('/api/events', consultation_events),
+       Mount('/', app=WSGIMiddleware(app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)